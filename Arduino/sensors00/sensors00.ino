@@ -18,6 +18,12 @@ measure time ellapsed with millis()
 
 */
 
+// send a frame counter byte after board id
+// (Python side: SensorsArduino(..., sequence=True))
+#define SEND_SEQUENCE 0
+
+byte sequence = 0;
+
 void setup() {
   Serial.begin(57600); // 9600 14400 19200 28800 38400 57600 115200
   //Serial.print("setup\n");
@@ -25,7 +31,7 @@ void setup() {
   delay(50);
   while (!Serial.available()) {
     Serial.write(0x07);
-    delay(300);
+    delay(10); // handshake byte every 10ms (Python side waits for it)
   }
   // read the byte that Python will send over
   Serial.read();
@@ -50,6 +56,9 @@ void loop() {
   
   Serial.write(0x07);
   Serial.write(0x00); // sensors board id
+#if SEND_SEQUENCE
+  Serial.write(sequence++); // frame counter (wraps at 256)
+#endif
   
   Serial.write(lowByte(sensor0));
   Serial.write(highByte(sensor0));
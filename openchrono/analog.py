@@ -3,16 +3,23 @@
 
 from __future__ import print_function, absolute_import
 
+import numpy as np
+
+from openchrono.calibration import Calibration, LookupTable
+
 class AnalogInput(object):
     def __init__(self, bits_resolution=None):
         self._calibrate_func = lambda x: x  # identity
+        self._table = None  # calibration lookup table (cache)
+        self._table_list = None  # same table for O(1) scalar lookup
+        self._lookup = False  # lookup table mode (see calibrate)
         
         self._raw_value = None
         self._value = None
         
         self.has_new_data = False
         
-        self.bits_resolution = bits_resolution
+        self._bits_resolution = bits_resolution
         
         self._raw_value_prev = None # previous raw value
         self.has_same_raw_value = False
@@ -20,8 +27,68 @@ class AnalogInput(object):
         self._value_prev = None # previous value
         self.has_same_value = False
 
-    def calibrate(self, func):
+    @property
+    def bits_resolution(self):
+        return self._bits_resolution
+
+    @bits_resolution.setter
+    def bits_resolution(self, value):
+        self._bits_resolution = value
+        self._invalidate_table()
+        if value is not None:
+            self._init_lookup()
+
+    def calibrate(self, func, lookup_table=False):
+        """Set calibration function - a callable or (better)
+        a openchrono.calibration.Calibration which can be applied
+        to whole arrays
+        
+        With lookup_table=True, calibration is materialized once into
+        a 2**bits_resolution entries table and every calibrated value
+        is then read from this table
+        """
         self._calibrate_func = func
+        self._lookup = lookup_table
+        self._invalidate_table()
+        self._init_lookup()
+
+    def _init_lookup(self):
+        """(Re)build lookup table (lookup table mode)"""
+        if self._lookup:
+            self._table_list = self.calibration_table.tolist()
+
+    def _invalidate_table(self):
+        self._table = None
+        self._table_list = None
+
+    @property
+    def calibration_table(self):
+        """Calibrated value of every possible raw value (cached)"""
+        if self._table is None:
+            if self.bits_resolution is None:
+                raise Exception("bits_resolution must be defined to create a calibration table")
+            func = self._calibrate_func
+            if isinstance(func, Calibration):
+                self._table = func.to_lookup_table(self.bits_resolution).table
+            else:
+                self._table = np.array([func(x) for x in range(2**self.bits_resolution)])
+        return self._table
+
+    def save_calibration_table(self, filename):
+        """Export calibration table (.npy) - for example alongside a recording"""
+        np.save(filename, self.calibration_table)
+
+    def load_calibration_table(self, filename):
+        """Import a calibration table exported with save_calibration_table"""
+        self.calibrate(LookupTable(np.load(filename)), lookup_table=True)
+
+    def calibrated(self, raw):
+        """Returns calibrated values of an array of raw values"""
+        if self._table_list is not None:
+            return self._table[np.asarray(raw, dtype=np.intp)]
+        if isinstance(self._calibrate_func, Calibration):
+            return self._calibrate_func.apply(raw)
+        return np.array([self._calibrate_func(x) for x in raw])
 
     @property
     def value(self):
@@ -36,8 +103,10 @@ class AnalogInput(object):
     def _update(self, new_raw_val):
         self._raw_value = new_raw_val
         
-        #if self._calibrate_func is not None:
-        self._value = self._calibrate_func(self._raw_value)
+        if self._table_list is not None:
+            self._value = self._table_list[self._raw_value]
+        else:
+            self._value = self._calibrate_func(self._raw_value)
         
         self.has_new_data = True
         
@@ -9,11 +9,19 @@ import logging
 import struct
 import serial
 import time
+import numpy as np
 
 from openchrono.analog import AnalogInput
+from openchrono.utils import monotonic
+from openchrono.ringbuffer import SampleRingBuffer
 
 logger = logging.getLogger(__name__)
 
+START_BYTE = 0x07
+FOOTER = b'\r\n'
+DTR_PULSE = 0.05  # reset pulse (s)
+HANDSHAKE_TIMEOUT = 3.0  # bootloader + setup of sketch (s)
+
 
 class SensorsHardware(object):
     def __init__(self, *args, **kwargs):
@@ -22,6 +30,13 @@ class SensorsHardware(object):
     def connect(self):
         pass
 
+    def connect_async(self, **kwargs):
+        """Connect in a new thread - returns a (started) ConnectThread
+        (several sensors can be connected at the same time)"""
+        thread = ConnectThread(self, **kwargs)
+        thread.start()
+        return thread
+
     def update(self):
         pass
 
@@ -34,134 +49,369 @@ class SensorsHardware(object):
 
     
 class _ArduinoBinaryMessage(object):
-    def __init__(self, adc_channels_number):
+    def __init__(self, adc_channels_number, sequence=False):
         self.max_adc_channels_number = 6
         self.adc_channels_number = min(adc_channels_number, self.max_adc_channels_number)
         self.allowed_adc_channels = range(self.adc_channels_number)  # 0->N-1
+        # optional frame counter byte (after board id) - see SEND_SEQUENCE in sketch
+        self.sequence = sequence
+        self._adc_offset = 3 if sequence else 2
         
-        self.format = "BB" \
+        self.format = "<BB" \
+            + ("B" if sequence else "") \
             + "".join(["H" for i in range(self.adc_channels_number)]) \
             + "BB"
         self._size = struct.calcsize(self.format)
+        self._dtype = self._create_dtype()
         
         self._d_calibrate_funcs = {}
         
         self._data = None
         
+    def _create_dtype(self):
+        """Returns a NumPy structured dtype equivalent to format"""
+        d_types = {"B": "u1", "H": "u2"}
+        endian, fmt = self.format[0], self.format[1:]
+        names = ["start", "board_id"] \
+            + (["seq"] if self.sequence else []) \
+            + ["ADC%d" % i for i in range(self.adc_channels_number)] \
+            + ["cr", "lf"]
+        return np.dtype([(name, endian + d_types[c]) for name, c in zip(names, fmt)])
+
     def parse(self, raw_data):
         self._raw_data = raw_data
         self._data = struct.unpack(self.format, raw_data)
 
+    def parse_many(self, raw_data):
+        """Decode a block of N contiguous frames at once
+        into a NumPy structured array (N rows)"""
+        return np.frombuffer(raw_data, dtype=self._dtype)
+
     @property
     def size(self):
         return self._size
 
+    @property
+    def dtype(self):
+        return self._dtype
+
     def ADC(self, channel):       
         if channel in self.allowed_adc_channels:
-            return self._data[2 + channel]
+            return self._data[self._adc_offset + channel]
         else:
             raise Exception("channel=%s must be in %s" % (channel, self.allowed_adc_channels))
 
+
+class _ArduinoFrameParser(object):
+    """A streaming parser which extracts fixed size binary frames
+    from a persistent byte buffer
+
+    A frame is START_BYTE, board id, ADC values and FOOTER.
+    No newline semantic is involved (an ADC byte can be 0x0a) and
+    parser resynchronizes on next header when a frame is corrupted.
+    """
+    def __init__(self, size, board_id=0x00):
+        self._size = size
+        self._header = bytearray([START_BYTE, board_id])
+        self._footer = bytearray(FOOTER)
+        self._buffer = bytearray()
+
+        self.frames_count = 0
+        self.discarded_bytes = 0
+
+    def feed(self, data):
+        self._buffer.extend(data)
+
+    def frames(self):
+        """Returns a list of complete frames (bytes) found in buffer
+        
+        Incomplete frame at the end of buffer is kept for next call
+        """
+        buf, size = self._buffer, self._size
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(self._header, pos)
+            if start < 0:
+                # keep last byte (it might be the beginning of a header)
+                end = max(pos, len(buf) - 1)
+                self.discarded_bytes += end - pos
+                pos = end
+                break
+            self.discarded_bytes += start - pos
+            end = start + size
+            if end > len(buf):
+                pos = start
+                break
+            if buf[end - len(self._footer):end] != self._footer:
+                # corrupted frame - resync on next header
+                self.discarded_bytes += 1
+                pos = start + 1
+                continue
+            frames.append(bytes(buf[start:end]))
+            pos = end
+        del buf[:pos]
+        self.frames_count += len(frames)
+        return frames
+
+    def _valid_frames_number(self):
+        """Returns number of valid contiguous frames at the beginning of buffer
+        (header and footer of every frames are checked at once)"""
+        n = len(self._buffer) // self._size
+        if n == 0:
+            return 0
+        a = np.frombuffer(bytes(self._buffer[:n * self._size]), dtype=np.uint8)
+        a = a.reshape(n, self._size)
+        valid = (a[:, 0] == self._header[0]) & (a[:, 1] == self._header[1]) \
+            & (a[:, -2] == self._footer[0]) & (a[:, -1] == self._footer[1])
+        if valid.all():
+            return n
+        return int(np.argmin(valid))
+
+    def block(self):
+        """Returns complete frames as a single bytes block (N * size)
+
+        When stream is synchronized, frames are extracted without any
+        Python loop. Parser falls back to frames() to resynchronize.
+        """
+        n = self._valid_frames_number()
+        size = n * self._size
+        block = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.frames_count += n
+        if len(self._buffer) >= self._size:
+            block += b"".join(self.frames())
+        return block
+
+    def clear(self):
+        del self._buffer[:]
+
 import threading
+from collections import deque
 
 
-class SensorThread(threading.Thread):
-    def __init__(self, sensor, time_to_sleep):
+class ConnectThread(threading.Thread):
+    """A thread which connects a sensor (see connect_async)
+    
+    result() waits for connection and raises exception of connect
+    """
+    def __init__(self, sensor, **kwargs):
         threading.Thread.__init__(self)
+        self.daemon = True
         
         self.sensor = sensor
-        self.time_to_sleep = time_to_sleep
+        self.kwargs = kwargs
+        self.exception = None
+
+    def run(self):
+        try:
+            self.sensor.connect(**self.kwargs)
+        except Exception as e:
+            self.exception = e
+
+    def result(self, timeout=None):
+        """Wait for connection (raise exception of connect if any)"""
+        self.join(timeout)
+        if self.is_alive():
+            raise serial.SerialTimeoutException("Connection to %s still running after %ss" % (self.sensor._device, timeout))
+        if self.exception is not None:
+            raise self.exception
 
-        #set to not running
-        self.running = False
 
-        #self.update()
+class SensorThread(threading.Thread):
+    """A reader thread which blocks on sensor (serial port with timeout)
+    and pushes decoded frames into a bounded queue
+    
+    Items of queue are (t, batch) tuples. When queue is full,
+    oldest items are dropped (and counted).
+    A stopped thread can't be started again (use sensor.start())
+    An exception of sensor (like serial.SerialException) ends thread
+    and is logged and kept as exception attribute
+    """
+    def __init__(self, sensor, queue_maxlen):
+        threading.Thread.__init__(self)
+        self.daemon = True
         
+        self.sensor = sensor
+        # deque append/popleft are atomic (no lock needed)
+        self.queue = deque(maxlen=queue_maxlen)
+        self.dropped = 0
+        self.exception = None  # exception which ended thread
+
+        self._stop_event = threading.Event()
+        self._new_data = threading.Event()
+
     def stop(self):
-        self.running = False            
+        self._stop_event.set()
+
+    @property
+    def running(self):
+        return self.is_alive() and not self._stop_event.is_set()
 
-    def restart(self):
-        if not self.running:
-            self.running = True
-        else:
-            raise Exception("Can't restart - thread was ever running")
-    
     def run(self):
         #loop until it's set to stopped
-        self.running = True
-        while(self.running):
-            #update data
-            self.sensor.update()
-            #sleep
-            time.sleep(self.time_to_sleep)
-        self.running = False
-    
-    def update(self):
-        raise NotImplementedError("Must be implmented in inherit class")
+        try:
+            while not self._stop_event.is_set():
+                #update data (blocking read with timeout)
+                if self.sensor.update():
+                    self._push((self.sensor.batch_t, self.sensor.batch))
+        except Exception as e:
+            logger.exception("Reader thread of %s %s failed" % (self.sensor._name, self.sensor._device))
+            self.exception = e
+
+    def _push(self, item):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(item)
+        self._new_data.set()
+
+    def wait(self, timeout=None):
+        """Wait for new data - returns True if new data is available"""
+        return self._new_data.wait(timeout)
+
+    def get(self):
+        """Drain queue and returns a list of (t, batch)"""
+        self._new_data.clear()
+        items = []
+        while True:
+            try:
+                items.append(self.queue.popleft())
+            except IndexError:
+                break
+        return items
 
 
 class SensorsArduino(SensorsHardware):
-    def __init__(self, device, baudrate, adc_channels_number, time_to_sleep=0.002, update_error_exception=False):
+    def __init__(self, device, baudrate, adc_channels_number, timeout=0.1, queue_maxlen=1000, update_error_exception=False, board_id=0x00, bulk=False, samples_maxlen=100000, sequence=False):
         
         super(SensorsArduino, self).__init__(device, baudrate)
         self._name = "Arduino"
         self._device = device
         self._baudrate = baudrate
-        self._timeout = 1
-        self._bin_msg = _ArduinoBinaryMessage(adc_channels_number=adc_channels_number)
+        self._timeout = timeout
+        self._bin_msg = _ArduinoBinaryMessage(adc_channels_number=adc_channels_number, sequence=sequence)
+        self._parser = _ArduinoFrameParser(self._bin_msg.size, board_id=board_id)
         self._ADC = [AnalogInput(bits_resolution=10) for i in range(adc_channels_number)]
         self._capabilities = ["ADC%d" % i for i in range(adc_channels_number)]
+        self._batch = np.empty(0, dtype=self._bin_msg.dtype)
+        self._batch_t = None
+        # transmission time of a frame (8N1: 10 bits per byte) - sketch sends frames back to back
+        self._frame_period = self._bin_msg.size * 10.0 / baudrate
+        self._adc_fields = ["ADC%d" % i for i in range(self._bin_msg.adc_channels_number)]
+        # every decoded samples (timestamp, sequence number, raw ADC)
+        # sequence number is counter of frames sent by board (when sketch sends it)
+        # else number of frames decoded
+        self.samples = SampleRingBuffer(samples_maxlen, self._bin_msg.adc_channels_number)
+        self._seq_last = None  # last sequence number (unwrapped)
+        self.handshake_latency = None  # time to connect (s)
         
-        self.thread = SensorThread(self, time_to_sleep)
+        self._queue_maxlen = queue_maxlen
+        self.thread = SensorThread(self, queue_maxlen)
 
         if update_error_exception:
             self._update_error = self._update_error_raise_exception
         else:
             self._update_error = self._update_error_no_exception
 
-    def connect(self):
+        if bulk:
+            self._update = self._update_bulk
+        else:
+            self._update = self._update_frames
+
+    def connect(self, handshake_timeout=HANDSHAKE_TIMEOUT, reset=True):
+        """Open serial port and wait for handshake byte of Arduino
+        
+        Arduino is reset by a short DTR pulse (reset=False to
+        reconnect to a running board). Handshake ends as soon as START_BYTE
+        is received - serial.SerialTimeoutException is raised if it's not
+        received within handshake_timeout seconds (handshake_latency is
+        time elapsed to receive it)
+        """
+        t0 = monotonic()
         self._ser = serial.Serial(self._device, self._baudrate, timeout=self._timeout)
 
-        # reset the arduino
-        self._ser.setDTR(level=False)
-        time.sleep(0.5)
+        if reset:
+            self._ser.setDTR(level=False)
+            time.sleep(DTR_PULSE)
         # ensure there is no stale data in the buffer
         self._ser.flushInput()
         self._ser.setDTR()
-        time.sleep(0.5)
 
         logger.info("Waiting for %s %s @ %d bauds..." % (self._name, self._device, self._baudrate))
 
-        # initial handshake w/ arduino
-        allowed_byte = 0x07
-        while True:
-            byte_received = struct.unpack("B", self._ser.read())[0]
-            logger.info("Handshake: %s" % byte_received)
-            if byte_received == allowed_byte:
-                break
+        # initial handshake w/ arduino (read every available bytes)
+        deadline = t0 + handshake_timeout
+        while struct.pack("B", START_BYTE) not in self._ser.read(self._ser.inWaiting() or 1):
+            if monotonic() > deadline:
+                self._ser.close()
+                raise serial.SerialTimeoutException("No handshake from %s %s within %.1fs"
+                    % (self._name, self._device, handshake_timeout))
+        self.handshake_latency = monotonic() - t0
         self._ser.flushInput()
+        self._parser.clear()
+        self._seq_last = None
         self._ser.write(b'\x10')
         #self._ser.flushInput()
 
-        logger.info("Connected to %s %s" % (self._name, self._device))
+        logger.info("Connected to %s %s (handshake: %.3fs)" % (self._name, self._device, self.handshake_latency))
 
     def update(self):
-        #print("update")
-        raw_data = self._ser.readline()
-        length, expected_length = len(raw_data), self._bin_msg.size
-        if length == expected_length:
-            self._bin_msg.parse(raw_data)
+        """Read every available bytes and decode every complete frame
+        
+        Returns True if at least one frame was decoded
+        """
+        raw_data = self._ser.read(self._ser.inWaiting() or 1)
+        self._batch_t = monotonic()
+        self._parser.feed(raw_data)
+        discarded_bytes = self._parser.discarded_bytes
+        updated = self._update()
+        if updated:
+            self.samples.write(self.batch_samples_t, self.batch_raw, self._sequence())
+        discarded = self._parser.discarded_bytes - discarded_bytes
+        if discarded > 0:
+            self._update_error(discarded)
+        return updated
+
+    def _update_frames(self):
+        frames = self._parser.frames()
+        for frame in frames:
+            self._bin_msg.parse(frame)
             self._update_channels()
-            self._ser.flushInput()
-            return True
+        self._batch = self._bin_msg.parse_many(b"".join(frames))
+        return len(frames) > 0
+
+    def _update_bulk(self):
+        """Decode every complete frame at once into batch
+        (channels are updated with last frame)"""
+        self._batch = self._bin_msg.parse_many(self._parser.block())
+        if len(self._batch) == 0:
+            return False
+        for channel, adc in enumerate(self._ADC):
+            adc._update(int(self._batch["ADC%d" % channel][-1]))
+        return True
+
+    def _sequence(self):
+        """Returns unwrapped sequence numbers of last batch (None
+        when frames have no counter) - frames lost on serial link
+        are gaps of sequence numbers"""
+        if not self._bin_msg.sequence:
+            return None
+        seq8 = self._batch["seq"].astype(np.int64)
+        if self._seq_last is None:
+            first = seq8[0]
         else:
-            return self._update_error(length, expected_length)
-
-    def _update_error_no_exception(self, length, expected_length):
+            # a same counter byte is next sequence number after 256 frames (never the same one)
+            first = self._seq_last + 1 + (seq8[0] - self._seq_last - 1) % 256
+        seq = first + np.concatenate([[0], np.cumsum(1 + (np.diff(seq8) - 1) % 256)])
+        self._seq_last = int(seq[-1])
+        return seq.astype(np.uint64)
+
+    def _update_error_no_exception(self, discarded):
+        logger.debug("%d byte(s) discarded (resync)" % discarded)
         return False
         
-    def _update_error_raise_exception(self, length, expected_length):
-        raise Exception("Incorrect length %d != %d" % (length, expected_length))
+    def _update_error_raise_exception(self, discarded):
+        raise Exception("Corrupted data - %d byte(s) discarded (resync)" % discarded)
 
     def _update_channels(self):
         for channel, adc in enumerate(self._ADC):
@@ -174,17 +424,60 @@ class SensorsArduino(SensorsHardware):
     def ADC(self):
         return self._ADC
 
+    @property
+    def batch(self):
+        """Frames decoded by last update as a NumPy structured array
+        with fields 'start', 'board_id', 'ADC0'... 'ADCn', 'cr', 'lf'"""
+        return self._batch
+
+    @property
+    def batch_t(self):
+        """Monotonic timestamp of last update (time of read)"""
+        return self._batch_t
+
+    @property
+    def frame_period(self):
+        """Transmission time of a frame (s)"""
+        return self._frame_period
+
+    @property
+    def batch_samples_t(self):
+        """Monotonic timestamp of each frame of last update (frames
+        of a read are spread back from read time by frame_period)"""
+        n = len(self._batch)
+        return self._batch_t - (n - 1 - np.arange(n)) * self._frame_period
+
+    @property
+    def batch_raw(self):
+        """Raw ADC values of last update (frames x channels)"""
+        return np.column_stack([self._batch[field] for field in self._adc_fields])
+
+    def start(self):
+        """Start reader thread (a new thread is created if
+        previous one was ever started)"""
+        if self.thread.is_alive():
+            raise Exception("Can't start - thread is still running")
+        if self.thread.ident is not None:
+            self.thread = SensorThread(self, self._queue_maxlen)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop reader thread and wait for it to finish"""
+        self.thread.stop()
+        if self.thread.ident is not None:
+            self.thread.join(timeout)
+
 def main_without_thread(device, baudrate, update_error_exception):
     import datetime
     import traceback
-    from utils import linear_function_with_limit
+    from openchrono.calibration import LinearWithLimit
     
     logging.basicConfig(level=logging.INFO)
     
     sensors00 = SensorsArduino(device=device, baudrate=baudrate, adc_channels_number=2, update_error_exception=update_error_exception)
     print("capabilities: %s" % sensors00.capabilities)
     sensors00.connect()
-    sensors00.ADC[0].calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
+    sensors00.ADC[0].calibrate(LinearWithLimit(520.0, 603.0, 0.0, 100.0))
     
     #start up sensors controller thread
     #sensors00.start()
@@ -215,30 +508,32 @@ def main_without_thread(device, baudrate, update_error_exception):
 def main_with_thread(device, baudrate, update_error_exception):
     import datetime
     import traceback
-    from utils import linear_function_with_limit
+    from openchrono.calibration import LinearWithLimit
     
     logging.basicConfig(level=logging.INFO)
     
     sensors00 = SensorsArduino(device=device, baudrate=baudrate, adc_channels_number=2, update_error_exception=update_error_exception)
     print("capabilities: %s" % sensors00.capabilities)
     sensors00.connect()
-    sensors00.ADC[0].calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
+    sensors00.ADC[0].calibrate(LinearWithLimit(520.0, 603.0, 0.0, 100.0))
     
     #start up sensors controller thread
-    sensors00.thread.start()
-    #sensors00.thread.running = True
+    sensors00.start()
 
     t_last = datetime.datetime.utcnow()
     try:
         while True:
+            # wait for reader thread (no polling)
+            if not sensors00.thread.wait(1.0):
+                continue
             t = datetime.datetime.utcnow()
-            print(sensors00._bin_msg._data)
+            for t_batch, batch in sensors00.thread.get():
+                print(t_batch, batch)
             ai0 = sensors00.ADC[0]
             y_raw = ai0.raw
             y = ai0.value
-            logger.info("%s %s %s" % (t, y, t - t_last))
+            logger.info("%s %s %s (dropped: %d)" % (t, y, t - t_last, sensors00.thread.dropped))
             t_last = t
-            time.sleep(0.02)
     except KeyboardInterrupt:
         print("Cancelled by user (CTRL+C)")
     except Exception as e:
@@ -246,10 +541,8 @@ def main_with_thread(device, baudrate, update_error_exception):
         #raise e
     finally:
         print("Stopping sensors controller (and thread)")
-        #stop the controller
-        sensors00.thread.stop()
-        #wait for the tread to finish if it hasn't already
-        sensors00.thread.join()        
+        #stop the controller and wait for the thread to finish
+        sensors00.stop()
     
     print("Done")
     
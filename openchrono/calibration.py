@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import
+
+import numpy as np
+
+
+class Calibration(object):
+    """A calibration function which can be applied to a scalar
+    or to a whole NumPy array of raw values
+
+    >>> cal = LinearWithLimit(500.0, 600.0, 0.0, 100.0)
+    >>> cal(550)
+    50.0
+    >>> cal(np.array([0, 550, 1023]))
+    array([  0.,  50., 100.])
+    """
+    def __call__(self, x):
+        y = self.apply(x)
+        if np.ndim(y) == 0:
+            return y.item()
+        return y
+
+    def apply(self, x):
+        raise NotImplementedError("Must be implemented in inherit class")
+
+    def to_lookup_table(self, bits_resolution):
+        """Precompile calibration into a 2**bits_resolution entries lookup table"""
+        return LookupTable(self.apply(np.arange(2**bits_resolution)))
+
+
+class LinearWithLimit(Calibration):
+    """Vectorized version of utils.linear_function_with_limit"""
+    def __init__(self, xmin, xmax, ymin, ymax):
+        self.xmin, self.xmax = xmin, xmax
+        self.ymin, self.ymax = ymin, ymax
+
+    def apply(self, x):
+        y = (self.ymax - self.ymin) / float(self.xmax - self.xmin) \
+            * (np.asarray(x, dtype=np.float64) - self.xmin) + self.ymin
+        return np.minimum(np.maximum(y, self.ymin), self.ymax)
+
+    def __repr__(self):
+        return "LinearWithLimit(%r, %r, %r, %r)" % (self.xmin, self.xmax, self.ymin, self.ymax)
+
+
+class Polynomial(Calibration):
+    """Polynomial calibration (coefficients from highest degree, like np.polyval)"""
+    def __init__(self, coefs):
+        self.coefs = list(coefs)
+
+    def apply(self, x):
+        return np.polyval(self.coefs, np.asarray(x, dtype=np.float64))
+
+    def __repr__(self):
+        return "Polynomial(%r)" % self.coefs
+
+
+class Piecewise(Calibration):
+    """Piecewise linear calibration through points (xp, fp)
+    (values are held constant outside of xp range)"""
+    def __init__(self, xp, fp):
+        self.xp = list(xp)
+        self.fp = list(fp)
+
+    def apply(self, x):
+        return np.interp(np.asarray(x, dtype=np.float64), self.xp, self.fp)
+
+    def __repr__(self):
+        return "Piecewise(%r, %r)" % (self.xp, self.fp)
+
+
+class LookupTable(Calibration):
+    """Calibration using a table indexed by (integer) raw values"""
+    def __init__(self, table):
+        self.table = np.asarray(table)
+
+    def apply(self, x):
+        return self.table[np.asarray(x, dtype=np.intp)]
+
+    def to_lookup_table(self, bits_resolution):
+        if len(self.table) == 2**bits_resolution:
+            return self
+        return super(LookupTable, self).to_lookup_table(bits_resolution)
+
+    def __repr__(self):
+        return "LookupTable(<%d entries>)" % len(self.table)
+
+
+def calibration_from_config(value):
+    """Create a Calibration from configuration (like sensors
+    'calibrations' of .openchrono.yaml)
+
+    A list is [xmin, xmax, ymin, ymax] of LinearWithLimit, a dict has
+    a single key: linear_with_limit, polynomial, piecewise or
+    lookup_table (table or filename of a .npy table)
+
+    >>> calibration_from_config([520.0, 603.0, 0.0, 100.0])
+    LinearWithLimit(520.0, 603.0, 0.0, 100.0)
+    >>> calibration_from_config({"piecewise": [[0, 1023], [0.0, 100.0]]})
+    Piecewise([0, 1023], [0.0, 100.0])
+    """
+    if not isinstance(value, dict):
+        return LinearWithLimit(*value)
+    if len(value) != 1:
+        raise Exception("calibration %r must have a single type" % value)
+    typ, args = list(value.items())[0]
+    if typ == "linear_with_limit":
+        return LinearWithLimit(*args)
+    elif typ == "polynomial":
+        return Polynomial(args)
+    elif typ == "piecewise":
+        return Piecewise(*args)
+    elif typ == "lookup_table":
+        if isinstance(args, str):
+            args = np.load(args)
+        return LookupTable(args)
+    else:
+        raise NotImplementedError("calibration %r not supported" % typ)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
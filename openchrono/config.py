@@ -15,7 +15,7 @@ def _load_config_file(filename):
     if filename is None:
         filename = os.path.join(HOME, ".openchrono.yaml")
     with open(filename, 'r') as f:
-        config = yaml.load(f)
+        config = yaml.safe_load(f)
     return config
 
 def _process_config(config):
@@ -32,8 +32,11 @@ sensors:
         hw_type: "arduino"
         device: "/dev/ttyUSB0"
         baudrate: 57600
+        adc_channels_number: 2
+        calibrations:
+            ADC0: [520.0, 603.0, 0.0, 100.0]
 """
-    return yaml.load(s_config)
+    return yaml.safe_load(s_config)
 
 def load_config(filename=None):
     config = _load_config_file(filename)
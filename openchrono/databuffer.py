@@ -3,20 +3,83 @@
 
 from __future__ import print_function, absolute_import
 
+import os
+import json
+import struct
+import numbers
+import datetime
+import threading
+import numpy as np
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from openchrono.utils import monotonic
+from openchrono.formatter import DataFormatter
+
 CSV_DEFAULT_SEP = ','
 CSV_DEFAULT_LF = '\n'
 
+BINARY_MAGIC = b'OCHRBIN1'
+BINARY_VERSION = 1
+EPOCH = datetime.datetime(1970, 1, 1)
+
 def append_same_length(columns, data):
     if columns != []:
         return len(columns) == len(data)
     return True
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # fixed width (isoformat drops microseconds when they are 0)
+
+def format_datetime(value):
+    return value.strftime(DATETIME_FORMAT)
+
+def format_datetime64(values):
+    """Vectorized format_datetime of a datetime64 array (list of str)"""
+    return np.char.replace(np.datetime_as_string(values, unit='us'), 'T', ' ').tolist()
+
+def format_float(value):
+    """repr of a float - NumPy floats are converted first
+    (their repr is like 'np.float64(0.1)' with NumPy >= 2)"""
+    return repr(float(value))
+
+def is_float(value):
+    """True for float and NumPy floating values (not for int or bool)"""
+    return isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral)
+
+# formatters by type (str is used for any other type)
+FORMATTERS = {
+    datetime.datetime: format_datetime,
+    float: format_float,
+}
+
 class DataBuffer(object):
-    def __init__(self, csv_filename, columns=None, csv_sep=CSV_DEFAULT_SEP, csv_lf=CSV_DEFAULT_LF):
+    """Write rows of data to a CSV file
+    
+    batch_size: number of rows accumulated in memory before being written
+        (None: every row is written immediately)
+    flush_interval: maximum time (in seconds) between 2 writes of accumulated rows
+    float_format: format of float values (like '%.3f') - default to repr
+    """
+    def __init__(self, csv_filename, columns=None, csv_sep=CSV_DEFAULT_SEP, csv_lf=CSV_DEFAULT_LF,
+                 batch_size=None, flush_interval=None, float_format=None):
         self._fd = open(csv_filename, "w")
         
         self.csv_sep = csv_sep
         self.csv_lf = csv_lf
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._t_flush = monotonic()
+
+        self._formatters_by_type = dict(FORMATTERS)
+        if float_format is not None:
+            self._formatters_by_type[float] = lambda x: float_format % x
+        self._formatters = None  # formatter of each column
+        self._unresolved = None  # columns without formatter yet (only None values so far)
         
         if columns is None:
             self._columns = []
@@ -30,19 +93,70 @@ class DataBuffer(object):
     @columns.setter
     def columns(self, value):
         self._columns = value
+        self._formatters = None
         self._append_columns()
     
     def _append_columns(self):
         if self.columns != []:
-            self.append(*self.columns)
+            self._write(self.csv_sep.join(self.columns) + self.csv_lf)
+    
+    def _formatter(self, value):
+        """Returns formatter of a value (str for any other type)"""
+        try:
+            return self._formatters_by_type[type(value)]
+        except KeyError:
+            pass
+        if isinstance(value, datetime.datetime):
+            return self._formatters_by_type[datetime.datetime]
+        if is_float(value):
+            return self._formatters_by_type[float]
+        return str
+
+    def _resolve_formatters(self, data):
+        """Formatter of a column is resolved with its first value which is not None"""
+        if self._formatters is None:
+            assert append_same_length(self.columns, data), "data and columns must have same length"
+            self._formatters = [str] * len(data)
+            self._unresolved = list(range(len(data)))
+        for i in self._unresolved:
+            if data[i] is not None:
+                self._formatters[i] = self._formatter(data[i])
+        self._unresolved = [i for i in self._unresolved if data[i] is None]
     
     def append(self, *data):
-        assert append_same_length(self.columns, data), "data and columns must have same length"
-        s = self.csv_sep.join(map(lambda x: str(x), data)) + self.csv_lf
-        self._fd.write(s)
+        if self._formatters is None or self._unresolved:
+            self._resolve_formatters(data)
+        try:
+            s = self.csv_sep.join([f(x) for f, x in zip(self._formatters, data)]) + self.csv_lf
+        except TypeError:
+            # a None value (missing measure) in a column with a float format
+            s = self.csv_sep.join([str(x) if x is None else f(x) for f, x in zip(self._formatters, data)]) + self.csv_lf
+        self._write(s)
+    
+    def _write(self, s):
+        if self.batch_size is None and self.flush_interval is None:
+            self._fd.write(s)
+            return
+        self._rows.append(s)
+        if (self.batch_size is not None and len(self._rows) >= self.batch_size) \
+                or (self.flush_interval is not None and monotonic() - self._t_flush >= self.flush_interval):
+            self.flush()
+    
+    def flush(self):
+        """Write accumulated rows to file"""
+        if self._rows:
+            self._fd.write("".join(self._rows))
+            del self._rows[:]
+        self._fd.flush()
+        self._t_flush = monotonic()
     
     def close(self):
-        self._fd.close()
+        """Write accumulated rows, sync to disk and close file"""
+        try:
+            self.flush()
+            os.fsync(self._fd.fileno())
+        finally:
+            self._fd.close()
     
     #def to_csv(self, filename):
     #    pass
@@ -54,6 +168,382 @@ class DataBuffer(object):
         self.close()
 
 
+class AsyncDataBuffer(object):
+    """Wrap a DataBuffer (or a BinaryDataBuffer) so append() only enqueues
+    rows into a bounded queue - formatting and I/O are done by a dedicated
+    writer thread (acquisition doesn't wait for disk)
+    
+    When queue is full, rows are dropped (and counted) unless block is True
+    """
+    _STOP = object()
+
+    def __init__(self, data_buffer, maxsize=10000, block=False):
+        self._buffer = data_buffer
+        self._queue = queue.Queue(maxsize)
+        self.block = block
+
+        # backpressure metrics
+        self.dropped = 0
+        self.max_queue_depth = 0
+        self.max_stall = 0.0  # longest write of writer thread (s)
+        self.written = 0
+
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def columns(self):
+        return self._buffer.columns
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "dropped": self.dropped,
+            "max_stall": self.max_stall,
+            "written": self.written,
+        }
+
+    def append(self, *data):
+        try:
+            self._queue.put(("append", data), self.block)
+        except queue.Full:
+            self.dropped += 1
+            return
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _run(self):
+        while True:
+            cmd, args = self._queue.get()
+            try:
+                if cmd is self._STOP:
+                    break
+                t0 = monotonic()
+                getattr(self._buffer, cmd)(*args)
+                stall = monotonic() - t0
+                if stall > self.max_stall:
+                    self.max_stall = stall
+                if cmd == "append":
+                    self.written += 1
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+        """Wait for every queued rows to be written and flush buffer"""
+        self._queue.put(("flush", ()))
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Write every queued rows, stop writer thread and close buffer"""
+        try:
+            self._queue.put((self._STOP, ()))
+            self._thread.join()
+        finally:
+            self._buffer.close()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+# columns of a change-only recording (see DeltaEncoder)
+DELTA_COLUMNS = ["seq", "count", "keyframe"]
+DELTA_COLUMNS_DTYPE = {"seq": "<u8", "count": "<u4", "keyframe": "u1"}
+
+def recording_dtype(channels):
+    """Returns dtype of binary records: int64 ns timestamp 't', uint32 'frame'
+    and raw uint16 values of channels (names)"""
+    return np.dtype([("t", "<i8"), ("frame", "<u4")] + [(name, "<u2") for name in channels])
+
+def delta_recording_dtype(channels):
+    """Returns dtype of binary records of a change-only recording
+    (see DeltaEncoder) - values are int32 (differences can be negative)"""
+    return np.dtype([("t", "<i8"), ("frame", "<u4")] + [(name, DELTA_COLUMNS_DTYPE[name]) for name in DELTA_COLUMNS]
+        + [(name, "<i4") for name in channels])
+
+class DeltaEncoder(object):
+    """Lossless change-only encoding of a stream of samples
+    (sequence number and raw values of channels)
+
+    A row is a run of consecutive samples (no missing sequence number)
+    with same values: (prefix..., seq, count, keyframe, values...)
+    - seq: sequence number of first sample of run
+    - count: number of samples of run
+    - keyframe: 1 if values are absolute, 0 if values are differences
+      with values of previous row
+    A keyframe is written at least every keyframe_interval samples
+    (a long run is split) so a recording can be decoded from any keyframe.
+
+    >>> encoder = DeltaEncoder(keyframe_interval=4)
+    >>> encoder.encode([0, 1, 2, 4, 5, 6], [[10], [10], [12], [12], [12], [12]], ("t0",))
+    [('t0', 0, 2, 1, 10), ('t0', 2, 1, 0, 2), ('t0', 4, 1, 0, 0)]
+    >>> encoder.flush()
+    [('t0', 5, 2, 1, 12)]
+    >>> encoder.encode([7, 8, 9], [[12], [13], [13]], [("t7",), ("t8",), ("t9",)])
+    [('t7', 7, 1, 0, 0), ('t8', 8, 1, 0, 1)]
+    >>> encoder.flush()
+    [('t9', 9, 1, 1, 13)]
+    """
+    def __init__(self, keyframe_interval=1000):
+        self.keyframe_interval = keyframe_interval
+        self._run = None  # [prefix, seq, count, keyframe, values] of current run
+        self._values_prev = None  # values of last row
+        self._since_keyframe = 0  # samples since last keyframe
+
+    def encode(self, seq, raw, prefix=()):
+        """Encode a block of samples and returns rows of runs which are
+        complete (prefix is put at the beginning of rows - like (t, frame))
+        
+        prefix is either a tuple (same prefix for every samples) or a list
+        with prefix of each sample (a row has prefix of its first sample)
+        """
+        seq = np.asarray(seq, dtype=np.int64)
+        rows = []
+        if len(seq) == 0:
+            return rows
+        raw = np.asarray(raw).reshape(len(seq), -1).astype(np.int64)
+        new_run = np.ones(len(seq), dtype=bool)
+        new_run[1:] = (seq[1:] != seq[:-1] + 1) | (raw[1:] != raw[:-1]).any(axis=1)
+        starts = np.flatnonzero(new_run)
+        stops = np.append(starts[1:], len(seq))
+        for start, stop in zip(starts, stops):
+            self._extend(prefix[start:stop] if isinstance(prefix, list) else prefix,
+                int(seq[start]), int(stop - start), raw[start], rows)
+        return rows
+
+    def _extend(self, prefix, seq, count, values, rows):
+        K = self.keyframe_interval
+        offset = 0  # first sample of run (prefix of each sample)
+        while count > 0:
+            run = self._run
+            if run is not None and seq == run[1] + run[2] and np.array_equal(values, run[4]) \
+                    and self._since_keyframe < K:
+                n = min(count, K - self._since_keyframe)
+                run[2] += n
+            else:
+                self._close(rows)
+                keyframe = self._values_prev is None or self._since_keyframe >= K
+                if keyframe:
+                    self._since_keyframe = 0
+                n = min(count, K - self._since_keyframe)
+                self._run = [prefix[offset] if isinstance(prefix, list) else prefix, seq, n, keyframe, values]
+            self._since_keyframe += n
+            seq += n
+            count -= n
+            offset += n
+
+    def _close(self, rows):
+        if self._run is None:
+            return
+        prefix, seq, count, keyframe, values = self._run
+        if keyframe:
+            data = values
+        else:
+            data = values - self._values_prev
+        rows.append(tuple(prefix) + (seq, count, int(keyframe)) + tuple(int(x) for x in data))
+        self._values_prev = values
+        self._run = None
+
+    def flush(self):
+        """Returns row of current run (end of recording)"""
+        rows = []
+        self._close(rows)
+        return rows
+
+
+def delta_decode(columns, channels):
+    """Decode rows of a change-only recording (dict of NumPy columns
+    with 'seq', 'count', 'keyframe' and channels) into every samples
+
+    Returns (index, seq, values) - index is the row of each sample
+    (to repeat others columns like t or frame) and values is a dict of
+    absolute values of channels. Rows before first keyframe can't be
+    decoded (truncated recording) and are skipped.
+
+    >>> columns = {'seq': np.array([0, 2, 4, 5]), 'count': np.array([2, 1, 1, 2]),
+    ...     'keyframe': np.array([1, 0, 0, 1]), 'pos': np.array([10, 2, 0, 12])}
+    >>> index, seq, values = delta_decode(columns, ['pos'])
+    >>> seq
+    array([0, 1, 2, 4, 5, 6])
+    >>> values['pos']
+    array([10, 10, 12, 12, 12, 12])
+    """
+    keyframe = np.asarray(columns["keyframe"]).astype(bool)
+    group = np.cumsum(keyframe)  # rows after a keyframe
+    valid = group > 0
+    count = np.where(valid, np.asarray(columns["count"]), 0).astype(np.int64)
+    index = np.repeat(np.arange(len(count)), count)
+    # position of each sample inside its run
+    offset = np.arange(len(index)) - np.repeat(np.cumsum(count) - count, count)
+    seq = np.asarray(columns["seq"]).astype(np.int64)[index] + offset
+    values = {}
+    for channel in channels:
+        data = np.asarray(columns[channel]).astype(np.int64)
+        total = np.cumsum(data)
+        # cumulative sum restarted at each keyframe
+        base = (total - data)[keyframe]
+        absolute = total - np.concatenate([[0], base])[group]
+        values[channel] = absolute[index]
+    return index, seq, values
+
+def sequence_loss(seq):
+    """Returns number of samples lost (missing sequence numbers)"""
+    seq = np.asarray(seq)
+    if len(seq) == 0:
+        return 0
+    return int(seq[-1] - seq[0] + 1 - len(seq))
+
+def datetime_to_ns(value):
+    """Returns number of nanoseconds since epoch of a (naive UTC) datetime"""
+    delta = value - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds) * 1000
+
+def _write_binary_header(fd, header):
+    s_header = json.dumps(header).encode('utf-8')
+    # pad header with spaces so records are 8 bytes aligned
+    length = len(BINARY_MAGIC) + 4 + len(s_header)
+    s_header += b' ' * (-length % 8)
+    fd.write(BINARY_MAGIC + struct.pack("<I", len(s_header)) + s_header)
+
+def _read_binary_header(fd):
+    magic = fd.read(len(BINARY_MAGIC))
+    if magic != BINARY_MAGIC:
+        raise Exception("%r is not an openchrono binary recording" % fd.name)
+    length = struct.unpack("<I", fd.read(4))[0]
+    header = json.loads(fd.read(length).decode('utf-8'))
+    offset = len(BINARY_MAGIC) + 4 + length
+    return header, offset
+
+class BinaryDataBuffer(object):
+    """Write fixed-width binary records (see recording_dtype)
+    
+    File is a small JSON header (columns dtype and calibration tables)
+    followed by records - it can be loaded with load_binary (np.memmap)
+    
+    calibrations: dict of calibration tables by column name
+        (like AnalogInput.calibration_table)
+    batch_size: number of records accumulated before being written
+    """
+    def __init__(self, filename, dtype, calibrations=None, batch_size=1000, metadata=None):
+        self._dtype = np.dtype(dtype)
+        self._fd = open(filename, "wb")
+        self._block = np.zeros(batch_size, dtype=self._dtype)
+        self._n = 0
+
+        if calibrations is None:
+            calibrations = {}
+        header = {
+            "version": BINARY_VERSION,
+            "dtype": [(name, self._dtype[name].str) for name in self._dtype.names],
+            "calibrations": dict((key, np.asarray(table).tolist()) for key, table in calibrations.items()),
+        }
+        if metadata is not None:
+            header["metadata"] = metadata
+        _write_binary_header(self._fd, header)
+
+    @property
+    def columns(self):
+        return list(self._dtype.names)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def append(self, *data):
+        """Append a record - t can be a datetime or a number of ns since epoch"""
+        t = data[0]
+        if isinstance(t, datetime.datetime):
+            t = datetime_to_ns(t)
+        self._block[self._n] = (t,) + data[1:]
+        self._n += 1
+        if self._n == len(self._block):
+            self.flush()
+
+    def append_many(self, records):
+        """Append a NumPy structured array of records at once"""
+        self.flush()
+        self._fd.write(np.asarray(records, dtype=self._dtype).tobytes())
+
+    def flush(self):
+        if self._n > 0:
+            self._fd.write(self._block[:self._n].tobytes())
+            self._n = 0
+        self._fd.flush()
+
+    def close(self):
+        try:
+            self.flush()
+            os.fsync(self._fd.fileno())
+        finally:
+            self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+def load_binary(filename):
+    """Returns (header, records) of a binary recording
+    
+    records is a read-only np.memmap (no parsing). An incomplete last
+    record (interrupted recording) is ignored.
+    """
+    with open(filename, "rb") as fd:
+        header, offset = _read_binary_header(fd)
+    dtype = np.dtype([(str(name), str(typ)) for name, typ in header["dtype"]])
+    n = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if n == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(n,))
+
+def binary_to_csv(filename_in, filename_out, calibrated=True, csv_sep=CSV_DEFAULT_SEP, csv_lf=CSV_DEFAULT_LF, chunksize=100000):
+    """Convert a binary recording to CSV (calibration tables of header
+    are applied to raw values when calibrated is True)"""
+    header, records = load_binary(filename_in)
+    columns = list(records.dtype.names)
+    tables = dict((key, np.asarray(table)) for key, table in header["calibrations"].items()) if calibrated else {}
+    # same text as DataBuffer (format_datetime and repr of floats)
+    formatter = DataFormatter(value_default='%r')
+    with open(filename_out, "w") as fd:
+        fd.write(csv_sep.join(columns) + csv_lf)
+        for start in range(0, len(records), chunksize):
+            block = records[start:start + chunksize]
+            cols = []
+            for column in columns:
+                if column == "t":
+                    cols.append(format_datetime64(block[column].view('datetime64[ns]')))
+                    continue
+                elif column in tables:
+                    values = tables[column][block[column]]
+                else:
+                    values = block[column]
+                cols.append(formatter.format_column(column, values))
+            fd.write("".join([csv_sep.join(row) + csv_lf for row in zip(*cols)]))
+
+
 def main():
     data = DataBuffer("data.csv")
     data.columns = ["a", "b", "c"]
@@ -5,7 +5,9 @@ import os
 import datetime
 
 DATA = 'data.csv'
+DATA_BINARY = 'data.bin'
 VIDEO = 'video.h264'
+CALIBRATION = 'calibration_%s.npy'
 
 class FilenameFactory(object):
     """A class to create filenames (for video or data) from a directory
@@ -13,15 +15,20 @@ class FilenameFactory(object):
     >>> filename = FilenameFactory("~/data/foo_dir")
     >>> filename.data
     '/home/pi/data/foo_dir/data.csv'
+    >>> filename.data_binary
+    '/home/pi/data/foo_dir/data.bin'
     >>> filename.video
     '/home/pi/data/foo_dir/video.h264'
     >>> filename.create("bar.file")
     '/home/pi/data/foo_dir/bar.file'
+    >>> filename.calibration("ADC0")
+    '/home/pi/data/foo_dir/calibration_ADC0.npy'
     """
-    def __init__(self, data_directory, recording_subdirectory="", data=DATA, video=VIDEO):
+    def __init__(self, data_directory, recording_subdirectory="", data=DATA, video=VIDEO, data_binary=DATA_BINARY):
         self.data_directory = os.path.expanduser(data_directory)
         self._recording_subdirectory = recording_subdirectory
         self._data = data
+        self._data_binary = data_binary
         self._video = video
 
     def create(self, filename):
@@ -32,9 +39,17 @@ class FilenameFactory(object):
     def data(self):
         return self.create(self._data)
 
+    @property
+    def data_binary(self):
+        return self.create(self._data_binary)
+
     @property
     def video(self):
         return self.create(self._video)
+
+    def calibration(self, name):
+        """Calibration table filename of an analog input (name like 'ADC0')"""
+        return self.create(CALIBRATION % name)
     
     @property
     def recording_directory(self):
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import
+
+import numpy as np
+
+
+class DataFormatter(object):
+    """Format keys and values of data (with a %-format per key)
+
+    A whole NumPy column can be formatted with format_column
+
+    >>> formatter = DataFormatter(value={'pos': '%05.1f'})
+    >>> formatter.text('pos', 3.14159)
+    'pos: 003.1'
+    >>> formatter.format_column('pos', np.array([1.0, 22.25]))
+    ['001.0', '022.2']
+    >>> formatter.format_column('t', np.array(['2015-11-21T14:46:55.1714'], dtype='datetime64[ns]'))
+    ['2015-11-21 14:46:55.171400']
+    """
+    def __init__(self, key_default='%s', value_default='%s', key=None, value=None):
+        self.key_format_default = key_default
+        self.value_format_default = value_default
+
+        if key is None:
+            self.d_key_format = {}
+        else:
+            self.d_key_format = key
+
+        if value is None:
+            self.d_value_format = {}
+        else:
+            self.d_value_format = value
+
+    def _get_format(self, key, d_fmt, fmt_default):
+        try:
+            return d_fmt[key]
+        except KeyError:
+            return fmt_default
+
+    def get_formats(self, key):
+        """Returns (key format, value format) of key - formats are read
+        at each call so d_key_format / d_value_format can be modified in place"""
+        return (self._get_format(key, self.d_key_format, self.key_format_default),
+            self._get_format(key, self.d_value_format, self.value_format_default))
+
+    def _get_value_format(self, key):
+        return self.get_formats(key)[1]
+
+    def _get_key_format(self, key):
+        return self.get_formats(key)[0]
+
+    def _key_value_format(self, key):
+        s_fmt = "%s: %s"
+        return s_fmt
+
+    def label(self, key):
+        """Returns text displayed before value (like 'key: ')"""
+        return self._key_value_format(key) % (self._get_key_format(key) % key, '')
+
+    def value(self, key, value):
+        return self._get_value_format(key) % value
+
+    def text(self, key, value):
+        s_fmt = self._key_value_format(key)
+        s_key, s_value = self.get_formats(key)
+        return s_fmt % (s_key % key, s_value % value)
+
+    def format_column(self, key, values):
+        """Returns a list with formatted values of a whole column
+        (datetime64 values are formatted as datetime.datetime)"""
+        values = np.asarray(values)
+        if values.dtype.kind == 'M':
+            values = values.astype('datetime64[us]')
+        return list(map(self._get_value_format(key).__mod__, values.tolist()))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
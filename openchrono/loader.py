@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import
+
+import os
+import logging
+import numpy as np
+
+from openchrono.filename import FilenameFactory
+from openchrono.databuffer import BinaryDataBuffer, load_binary, DELTA_COLUMNS, delta_decode, sequence_loss
+
+logger = logging.getLogger(__name__)
+
+COL_T = 't'
+COL_SEQ = 'seq'
+CACHE_SUFFIX = '.cache.bin'
+
+
+class Recording(object):
+    """Data of a recording as a NumPy structured array (memory mapped
+    when loaded from a binary file) - 't' column is int64 ns since epoch"""
+    def __init__(self, filename, records, calibrations=None):
+        self.filename = filename
+        self.records = records
+        if calibrations is None:
+            calibrations = {}
+        self.calibrations = dict((key, np.asarray(table)) for key, table in calibrations.items())
+
+    @property
+    def columns(self):
+        return list(self.records.dtype.names)
+
+    @property
+    def lost(self):
+        """Number of samples lost (None if recording has no sequence numbers)"""
+        if COL_SEQ not in self.columns:
+            return None
+        return sequence_loss(self.records[COL_SEQ])
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, column):
+        return self.records[column]
+
+    def slice(self, start, stop):
+        """Returns a Recording with records[start:stop] (no copy)"""
+        return Recording(self.filename, self.records[start:stop], self.calibrations)
+
+    def column(self, column, calibrated=True):
+        """Returns values of a column ('t' as datetime64[ns], calibration
+        table applied to raw values when calibrated is True)"""
+        values = self.records[column]
+        if column == COL_T:
+            return values.view('datetime64[ns]')
+        if calibrated and column in self.calibrations:
+            return self.calibrations[column][values]
+        return values
+
+    def to_dataframe(self, calibrated=True):
+        import pandas as pd
+        return pd.DataFrame(dict((column, self.column(column, calibrated)) for column in self.columns),
+            columns=self.columns)
+
+
+def _cache_filename(filename):
+    return filename + CACHE_SUFFIX
+
+def _source_metadata(filename):
+    stat = os.stat(filename)
+    return {"source": os.path.basename(filename), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def _load_cache(filename):
+    """Returns cached records of a CSV file (None if there is no valid cache)"""
+    filename_cache = _cache_filename(filename)
+    if not os.path.exists(filename_cache):
+        return None
+    try:
+        header, records = load_binary(filename_cache)
+    except Exception:
+        logger.warning("Can't read cache %r" % filename_cache)
+        return None
+    if header.get("metadata") != _source_metadata(filename):
+        return None
+    return records
+
+def parse_datetime(values):
+    """Parse timestamps of a CSV file (with or without microseconds:
+    recordings made before fixed width timestamps drop them when they are 0)"""
+    import pandas as pd
+    try:
+        return pd.to_datetime(values, format='ISO8601')
+    except ValueError:  # pandas < 2.0 (format is inferred for each value)
+        return pd.to_datetime(values)
+
+def _parse_csv(filename):
+    """Parse a CSV file into a NumPy structured array ('t' as int64 ns)"""
+    import pandas as pd
+    df = pd.read_csv(filename)
+    columns = []
+    for column in df.columns:
+        values = df[column].values
+        if column == COL_T:
+            values = parse_datetime(df[column]).values.astype('datetime64[ns]').view(np.int64)
+        columns.append((str(column), values))
+    records = np.zeros(len(df), dtype=[(column, values.dtype) for column, values in columns])
+    for column, values in columns:
+        records[column] = values
+    return records
+
+def _write_cache(filename, records):
+    filename_cache = _cache_filename(filename)
+    filename_tmp = filename_cache + '.tmp'
+    try:
+        with BinaryDataBuffer(filename_tmp, records.dtype, metadata=_source_metadata(filename)) as data:
+            data.append_many(records)
+        os.rename(filename_tmp, filename_cache)
+    except (IOError, OSError):
+        logger.warning("Can't write cache %r" % filename_cache)
+
+def is_change_only(records):
+    return all(name in records.dtype.names for name in DELTA_COLUMNS)
+
+def _decode_change_only(records):
+    """Expand rows of a change-only recording (see DeltaEncoder) into
+    every samples - 'count' and 'keyframe' columns are replaced by
+    absolute values of each sample with its sequence number"""
+    others = [name for name in records.dtype.names if name not in DELTA_COLUMNS]
+    channels = [name for name in others if name not in [COL_T, 'frame']]
+    index, seq, values = delta_decode(records, channels)
+    dtype = [(name, records.dtype[name]) for name in others if name not in channels] \
+        + [(COL_SEQ, np.uint64)] + [(name, records.dtype[name]) for name in channels]
+    decoded = np.zeros(len(seq), dtype=dtype)
+    for name in others:
+        decoded[name] = values[name] if name in channels else records[name][index]
+    decoded[COL_SEQ] = seq
+    return decoded
+
+def load_data(filename, cache=True):
+    """Load a data file (binary recording or CSV) and returns a Recording
+
+    A CSV file is parsed only once: a binary sidecar (data.csv.cache.bin)
+    is created next to it and memory mapped on later loads (it's
+    recreated when CSV file changes)
+    """
+    logger.info("Reading %r" % filename)
+    if not filename.endswith('.csv'):
+        header, records = load_binary(filename)
+        if is_change_only(records):
+            records = _decode_change_only(records)
+        return Recording(filename, records, header["calibrations"])
+    records = _load_cache(filename) if cache else None
+    if records is None:
+        records = _parse_csv(filename)
+        if cache and not records.dtype.hasobject:
+            _write_cache(filename, records)
+            cached = _load_cache(filename)
+            if cached is not None:
+                records = cached
+    if is_change_only(records):
+        records = _decode_change_only(records)
+    return Recording(filename, records)
+
+def _recording_filename(directory, filename=None):
+    filename_factory = FilenameFactory(directory)
+    if filename is not None:
+        return filename_factory.create(filename)
+    elif os.path.exists(filename_factory.data_binary):
+        return filename_factory.data_binary
+    else:
+        return filename_factory.data
+
+def load_recording(directory, filename=None, cache=True):
+    """Load data of a recording directory (data.bin if it exists
+    else data.csv - or filename inside this directory)
+    
+    Raw (integer) columns without calibration are calibrated with
+    calibration table of directory (calibration_<column>.npy) if any
+    """
+    recording = load_data(_recording_filename(directory, filename), cache)
+    filename_factory = FilenameFactory(directory)
+    for column in recording.columns:
+        filename_table = filename_factory.calibration(column)
+        if column not in recording.calibrations and recording[column].dtype.kind in 'iu' \
+                and os.path.exists(filename_table):
+            recording.calibrations[column] = np.load(filename_table)
+    return recording
+
+def _csv_is_change_only(filename):
+    import pandas as pd
+    columns = pd.read_csv(filename, nrows=0).columns
+    return all(name in columns for name in DELTA_COLUMNS)
+
+def iter_dataframes(directory, chunksize, filename=None, calibrated=True):
+    """Yields DataFrames of at most chunksize rows of a recording
+    (memory is bounded by chunksize)
+    
+    Binary recordings (and CSV files with a valid cache) are memory
+    mapped, others CSV files are read by blocks
+    """
+    filename_data = _recording_filename(directory, filename)
+    if filename_data.endswith('.csv') and _load_cache(filename_data) is None \
+            and not _csv_is_change_only(filename_data):
+        import pandas as pd
+        logger.info("Reading %r by blocks of %d rows" % (filename_data, chunksize))
+        for df in pd.read_csv(filename_data, chunksize=chunksize):
+            yield df
+        return
+    # (a change-only recording is decoded at once)
+    recording = load_recording(directory, filename)
+    for start in range(0, len(recording), chunksize):
+        yield recording.slice(start, start + chunksize).to_dataframe(calibrated)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import
+
+import threading
+import numpy as np
+
+
+class SampleRingBuffer(object):
+    """A preallocated ring buffer of timestamped samples
+
+    Each sample is a monotonic timestamp, a sequence number and
+    raw values of every channels.
+    A single writer (reader thread) fills it and consumers drain it
+    in bulk using their own cursor.
+
+    >>> ring = SampleRingBuffer(4, 2)
+    >>> cursor = ring.cursor()
+    >>> ring.write(1.0, [[10, 11], [20, 21]])
+    >>> t, seq, raw = cursor.read()
+    >>> seq
+    array([0, 1], dtype=uint64)
+    >>> raw[:, 1]
+    array([11, 21], dtype=uint16)
+    """
+    def __init__(self, maxlen, channels, dtype=np.uint16):
+        self._maxlen = maxlen
+        self._t = np.zeros(maxlen, dtype=np.float64)
+        self._seq = np.zeros(maxlen, dtype=np.uint64)
+        self._raw = np.zeros((maxlen, channels), dtype=dtype)
+        self._count = 0  # number of samples ever written
+        self._lock = threading.Lock()
+
+    @property
+    def maxlen(self):
+        return self._maxlen
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def channels(self):
+        return self._raw.shape[1]
+
+    @property
+    def dtype(self):
+        return self._raw.dtype
+
+    def __len__(self):
+        return min(self._count, self._maxlen)
+
+    def write(self, t, raw, seq=None):
+        """Write a block of samples
+
+        t: timestamp (scalar or one per sample)
+        raw: raw values (n samples x channels)
+        seq: sequence numbers (default: count of samples written)
+        """
+        raw = np.asarray(raw)
+        n = len(raw)
+        if n == 0:
+            return
+        t = np.broadcast_to(np.asarray(t, dtype=np.float64), (n,))
+        if seq is None:
+            seq = np.arange(self._count, self._count + n, dtype=np.uint64)
+        if n > self._maxlen:  # only last samples can be kept
+            skip = n - self._maxlen
+            t, seq, raw = t[skip:], seq[skip:], raw[skip:]
+        else:
+            skip = 0
+        idx = (self._count + skip + np.arange(len(raw))) % self._maxlen
+        with self._lock:
+            self._t[idx] = t
+            self._seq[idx] = seq
+            self._raw[idx] = raw
+            self._count += n
+
+    def read(self, position):
+        """Returns (t, seq, raw, position, lost) with samples
+        written since position (copies)
+
+        lost is the number of samples overwritten before being read
+        """
+        with self._lock:
+            count = self._count
+            lost = max(0, count - self._maxlen - position)
+            position += lost
+            idx = np.arange(position, count) % self._maxlen
+            t, seq, raw = self._t[idx], self._seq[idx], self._raw[idx]
+        return t, seq, raw, count, lost
+
+    def cursor(self, position=None):
+        """Returns a cursor (default: only new samples will be read)"""
+        return RingBufferCursor(self, position)
+
+
+class RingBufferCursor(object):
+    def __init__(self, ring, position=None):
+        self._ring = ring
+        if position is None:
+            position = ring.count
+        self.position = position
+        self.lost = 0  # samples overwritten before being read
+
+    @property
+    def available(self):
+        return self._ring.count - self.position
+
+    def read(self):
+        """Returns (t, seq, raw) arrays of samples since last read"""
+        t, seq, raw, self.position, lost = self._ring.read(self.position)
+        self.lost += lost
+        return t, seq, raw
+
+
+class MergedCursor(object):
+    """Merge samples of several ring buffers (one per sensor) into a
+    single time-ordered stream
+
+    Each merged sample has values of every channels of every rings
+    (columns of ring 0, then ring 1...): values of others rings are
+    their last known values (0 before their first sample).
+    Merged sequence numbers increase by 1 for each sample plus number
+    of samples lost by its ring, so gaps show losses of every rings.
+
+    >>> ring0, ring1 = SampleRingBuffer(8, 1), SampleRingBuffer(8, 2)
+    >>> merged = MergedCursor([ring0, ring1])
+    >>> ring0.write([1.0, 3.0], [[10], [11]])
+    >>> ring1.write(2.0, [[20, 21]])
+    >>> t, source, seq, raw = merged.read()
+    >>> source
+    array([0, 1, 0])
+    >>> raw.tolist()
+    [[10, 0, 0], [10, 20, 21], [11, 20, 21]]
+    """
+    def __init__(self, rings, position=None):
+        self.cursors = [ring.cursor(position) for ring in rings]
+        self._widths = [ring.channels for ring in rings]
+        self._dtype = np.result_type(*[ring.dtype for ring in rings]) if rings else np.uint16
+        self._last = [np.zeros(width, dtype=self._dtype) for width in self._widths]
+        self._seq_last = [None for ring in rings]  # last sequence number of each ring
+        self._seq = 0  # next merged sequence number
+
+    @property
+    def channels(self):
+        return sum(self._widths)
+
+    @property
+    def lost(self):
+        """Samples overwritten before being read (every rings)"""
+        return sum(cursor.lost for cursor in self.cursors)
+
+    def read(self):
+        """Returns (t, source, seq, raw) of samples of every rings since
+        last read - source is index of ring of each sample"""
+        blocks = [cursor.read() for cursor in self.cursors]
+        t = np.concatenate([block[0] for block in blocks])
+        source = np.concatenate([np.full(len(block[0]), i, dtype=np.intp) for i, block in enumerate(blocks)])
+        steps = []  # merged sequence increment of each sample
+        for i, (t_i, seq_i, raw_i) in enumerate(blocks):
+            seq_i = seq_i.astype(np.int64)
+            if len(seq_i) == 0:
+                steps.append(np.zeros(0, dtype=np.int64))
+                continue
+            prev = seq_i[0] - 1 if self._seq_last[i] is None else self._seq_last[i]
+            steps.append(np.diff(np.concatenate([[prev], seq_i])))
+            self._seq_last[i] = int(seq_i[-1])
+        steps = np.concatenate(steps) if steps else np.zeros(0, dtype=np.int64)
+        order = np.argsort(t, kind='mergesort')  # stable (samples of a ring stay in order)
+        t, source, steps = t[order], source[order], steps[order]
+        seq = self._seq + np.cumsum(steps) - 1
+        if len(seq) > 0:
+            self._seq = int(seq[-1]) + 1
+        raw = np.zeros((len(t), self.channels), dtype=self._dtype)
+        col = 0
+        rows = np.arange(len(t))
+        for i, (t_i, seq_i, raw_i) in enumerate(blocks):
+            width = self._widths[i]
+            positions = np.flatnonzero(source == i)
+            # last sample of ring i at (or before) each merged sample
+            k = np.searchsorted(positions, rows, side='right') - 1
+            values = np.vstack([self._last[i][np.newaxis, :], raw_i])
+            raw[:, col:col + width] = values[k + 1]
+            if len(raw_i) > 0:
+                self._last[i] = raw_i[-1].copy()
+            col += width
+        return t, source, seq.astype(np.uint64), raw
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, absolute_import
+
+import click
+
+import os
+import logging
+from collections import OrderedDict
+
+from openchrono.arduino import SensorsArduino
+from openchrono.calibration import calibration_from_config
+from openchrono.config import HOME, load_config
+from openchrono.ringbuffer import MergedCursor
+from openchrono.utils import monotonic
+
+logger = logging.getLogger(__name__)
+
+# sensor class of each hw_type of configuration
+HW_TYPES = {
+    "arduino": SensorsArduino,
+}
+
+ADC_CHANNELS_NUMBER_DEFAULT = 2
+CALIBRATION_DEFAULT = [520.0, 603.0, 0.0, 100.0]  # LinearWithLimit
+
+
+def create_sensor(sensor_config):
+    """Create a sensor from its configuration (hw_type, device, baudrate...)
+    - 'calibrations' (by capability) are applied to analog inputs"""
+    sensor_config = dict(sensor_config)
+    hw_type = sensor_config.pop("hw_type")
+    try:
+        cls = HW_TYPES[hw_type]
+    except KeyError:
+        raise NotImplementedError("hw_type %r not supported (%s)" % (hw_type, ", ".join(sorted(HW_TYPES))))
+    # without 'calibrations', ADC0 has calibration previously hard-coded in scripts
+    calibrations = sensor_config.pop("calibrations", {"ADC0": CALIBRATION_DEFAULT}) or {}
+    sensor_config.setdefault("adc_channels_number", ADC_CHANNELS_NUMBER_DEFAULT)
+    sensor = cls(**sensor_config)
+    for capability, calibration in calibrations.items():
+        ai = sensor.ADC[sensor.capabilities.index(capability)]
+        ai.calibrate(calibration_from_config(calibration), lookup_table=True)
+    return sensor
+
+def default_config(device, baudrate):
+    """Returns configuration of a single Arduino (when there is no config file)"""
+    return {"sensors": OrderedDict([
+        ("sensor00", {
+            "hw_type": "arduino",
+            "device": device,
+            "baudrate": baudrate,
+            "calibrations": {"ADC0": CALIBRATION_DEFAULT},
+        }),
+    ])}
+
+def sensors_config(filename=None, device='/dev/ttyUSB0', baudrate=57600):
+    """Returns configuration of filename (default to ~/.openchrono.yaml
+    if it exists) else configuration of a single Arduino on device"""
+    filename_default = os.path.join(HOME, ".openchrono.yaml")
+    if filename:
+        filename = os.path.expanduser(filename)
+    elif os.path.exists(filename_default):
+        filename = filename_default
+    else:
+        logger.info("No config file - %s @ %d bauds" % (device, baudrate))
+        return default_config(device, baudrate)
+    logger.info("Sensors of %r (--device and --baudrate are ignored)" % filename)
+    return load_config(filename)
+
+
+class SensorManager(object):
+    """A set of named sensors (created from configuration)
+
+    Sensors are connected in parallel and each sensor is read by its
+    own thread. Data of every sensors are available as a snapshot
+    (last values) or as a merged time-ordered stream of samples.
+    """
+    def __init__(self, sensors):
+        self.sensors = OrderedDict(sensors)  # name -> sensor
+
+    @classmethod
+    def from_config(cls, config=None, filename=None):
+        """Create sensors of config (or of config file)"""
+        if config is None:
+            config = load_config(filename)
+        return cls((name, create_sensor(sensor_config)) for name, sensor_config in config["sensors"].items())
+
+    def __len__(self):
+        return len(self.sensors)
+
+    def __iter__(self):
+        return iter(self.sensors.values())
+
+    def __getitem__(self, name):
+        return self.sensors[name]
+
+    @property
+    def names(self):
+        return list(self.sensors.keys())
+
+    def _channels(self, name, sensor):
+        for capability, ai in zip(sensor.capabilities, sensor.ADC):
+            column = capability if len(self.sensors) == 1 else "%s_%s" % (name, capability)
+            yield column, ai
+
+    def channels(self):
+        """Returns (column, analog input) of every channel of every sensor
+
+        Columns are capabilities of sensors (prefixed with sensor name
+        when there are several sensors)
+        """
+        return [channel for name, sensor in self.sensors.items() for channel in self._channels(name, sensor)]
+
+    @property
+    def columns(self):
+        return [column for column, ai in self.channels()]
+
+    def connect(self, **kwargs):
+        """Connect every sensors at the same time (see connect_async)
+        so startup time doesn't grow with number of sensors
+        
+        kwargs are passed to connect of each sensor (handshake_timeout...)
+        """
+        t0 = monotonic()
+        connections = [(name, sensor.connect_async(**kwargs)) for name, sensor in self.sensors.items()]
+        errors = OrderedDict()
+        for name, connection in connections:
+            try:
+                connection.result()
+            except Exception as e:
+                logger.error("Can't connect %s: %s" % (name, e))
+                errors[name] = e
+        if errors:
+            raise Exception("Can't connect %s" % ", ".join("%s (%s)" % (name, e) for name, e in errors.items()))
+        logger.info("%d sensor(s) connected in %.3fs" % (len(self.sensors), monotonic() - t0))
+
+    def start(self):
+        """Start one reader thread per sensor"""
+        for sensor in self:
+            sensor.start()
+
+    def stop(self, timeout=None):
+        for sensor in self:
+            sensor.stop(timeout)
+
+    def check(self):
+        """Raise an exception if reader thread of a sensor failed"""
+        for name, sensor in self.sensors.items():
+            if sensor.thread.exception is not None:
+                raise Exception("Reader thread of %s failed (%r)" % (name, sensor.thread.exception))
+
+    def snapshot(self):
+        """Returns last calibrated value of every channel (column -> value)
+        - None when a sensor has no sample yet"""
+        values = OrderedDict()
+        for name, sensor in self.sensors.items():
+            ring = sensor.samples
+            t, seq, raw, count, lost = ring.read(max(ring.count - 1, 0))
+            for i, (column, ai) in enumerate(self._channels(name, sensor)):
+                values[column] = ai.calibrated(raw[-1:, i])[0].item() if len(raw) > 0 else None
+        return values
+
+    def stream(self, position=None):
+        """Returns a MergedCursor of samples of every sensors
+        (columns of raw values are columns) - default: only new samples"""
+        return MergedCursor([sensor.samples for sensor in self], position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.stop()
+
+
+@click.command()
+@click.option('--config', default='', help='Config file (default: ~/.openchrono.yaml)')
+@click.option('--device', default='/dev/ttyUSB0', help='device (without config file)')
+@click.option('--baudrate', default=57600, help='Baudrate (without config file)')
+def main(config, device, baudrate):
+    import time
+    logging.basicConfig(level=logging.INFO)
+
+    with SensorManager.from_config(sensors_config(config, device, baudrate)) as sensors:
+        print("columns: %s" % sensors.columns)
+        sensors.connect()
+        sensors.start()
+        try:
+            while True:
+                print(sensors.snapshot())
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print("Cancelled by user (CTRL+C)")
+
+
+if __name__ == '__main__':
+    main()
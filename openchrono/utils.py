@@ -3,6 +3,10 @@
 
 from __future__ import print_function, absolute_import
 
+try:
+    from time import monotonic
+except ImportError:  # Python 2
+    from time import time as monotonic
 
 def mapv(x, x0, x1, y0, y1, typ=None):
     if typ is None:
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import click
+
+import os
+import re
+import time
+import hashlib
+import logging
+import multiprocessing
+
+from openchrono.filename import FilenameFactory
+from data_postprocessing import postprocess_directory
+
+logger = logging.getLogger(__name__)
+
+# recording directories created by FilenameFactory.new_recording
+RECORDING_DIRECTORY_PATTERN = re.compile(r'^\d{8}-\d{6}-\d{6}$')
+HASH_SUFFIX = '.sha1'
+
+
+def find_recordings(data_folder):
+    """Returns sorted list of recording directories (with data) of data_folder"""
+    directories = []
+    for name in sorted(os.listdir(data_folder)):
+        directory = os.path.join(data_folder, name)
+        filename = FilenameFactory(directory)
+        if RECORDING_DIRECTORY_PATTERN.match(name) and os.path.isdir(directory) \
+                and (os.path.exists(filename.data) or os.path.exists(filename.data_binary)):
+            directories.append(directory)
+    return directories
+
+def _data_filename(directory):
+    filename = FilenameFactory(directory)
+    if os.path.exists(filename.data_binary):
+        return filename.data_binary
+    return filename.data
+
+def file_hash(filename, blocksize=2**20):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        for block in iter(lambda: fd.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def is_up_to_date(directory, filename_out, check_hash):
+    """Output is up to date when it's newer than data
+    (or, with check_hash, when data content didn't change)"""
+    filename_in = _data_filename(directory)
+    filename_out = os.path.join(directory, filename_out)
+    if not os.path.exists(filename_out):
+        return False
+    if os.path.getmtime(filename_out) >= os.path.getmtime(filename_in):
+        return True
+    if check_hash and os.path.exists(filename_out + HASH_SUFFIX):
+        with open(filename_out + HASH_SUFFIX) as fd:
+            same_content = fd.read().strip() == file_hash(filename_in)
+        if same_content:
+            os.utime(filename_out, None)  # hash won't be computed next time
+        return same_content
+    return False
+
+def _remove_output(filename_out):
+    """Remove output (and its hash) which doesn't match data anymore"""
+    for filename in [filename_out, filename_out + HASH_SUFFIX]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+def _process(args):
+    directory, filename_out, index, chunksize, check_hash = args
+    t0 = time.time()
+    filename_out = os.path.join(directory, filename_out)
+    try:
+        rows = postprocess_directory(directory, filename_out, index, chunksize)
+        if check_hash:
+            with open(filename_out + HASH_SUFFIX, 'w') as fd:
+                fd.write(file_hash(_data_filename(directory)))
+        return directory, rows, None, time.time() - t0
+    except Exception as e:
+        _remove_output(filename_out)
+        return directory, 0, repr(e), time.time() - t0
+
+
+@click.command()
+@click.option('--data-folder', default='~/data', help="Data folder (with recording directories)")
+@click.option('--filename-out', default='data_postprocessed.csv', help='Filename output')
+@click.option('--index', default='frame', help="Set index to 'time' or to 'frame'")
+@click.option('--chunksize', default=0, help='Process recordings by blocks of rows (0: whole recording)')
+@click.option('--processes', default=0, help='Number of processes (0: number of CPU)')
+@click.option('--hash/--no-hash', 'check_hash', default=False, help='Use content hash of data to check if output is up to date')
+@click.option('--force/--no-force', default=False, help='Process even up to date recordings')
+def main(data_folder, filename_out, index, chunksize, processes, check_hash, force):
+    logging.basicConfig(level=logging.WARNING)
+
+    data_folder = os.path.expanduser(data_folder)
+    index = index.lower()
+    if processes <= 0:
+        processes = multiprocessing.cpu_count()
+
+    directories = find_recordings(data_folder)
+    to_process = [directory for directory in directories
+        if force or not is_up_to_date(directory, filename_out, check_hash)]
+    print("%d recording(s) found in %r - %d to process (%d process(es))"
+        % (len(directories), data_folder, len(to_process), processes))
+
+    t0 = time.time()
+    errors = 0
+    tasks = [(directory, filename_out, index, chunksize, check_hash) for directory in to_process]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for i, (directory, rows, error, elapsed) in enumerate(pool.imap_unordered(_process, tasks)):
+            if error is None:
+                print("[%d/%d] %s: %d rows in %.2fs" % (i + 1, len(tasks), directory, rows, elapsed))
+            else:
+                errors += 1
+                print("[%d/%d] %s: ERROR %s" % (i + 1, len(tasks), directory, error))
+    finally:
+        pool.close()
+        pool.join()
+    print("Done in %.2fs (%d error(s))" % (time.time() - t0, errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import click
+
+from openchrono.filename import FilenameFactory
+from openchrono.databuffer import binary_to_csv
+
+
+@click.command()
+@click.argument('directory')
+@click.option('--filename-out', default='data.csv', help='Filename output (CSV)')
+@click.option('--calibrated/--raw', default=True, help='Apply calibration tables to raw values')
+def main(directory, filename_out, calibrated):
+    filename = FilenameFactory(directory)
+    filename_in = filename.data_binary
+    filename_out = filename.create(filename_out)
+    print("Converting %r to %r" % (filename_in, filename_out))
+    binary_to_csv(filename_in, filename_out, calibrated=calibrated)
+
+
+if __name__ == '__main__':
+    main()
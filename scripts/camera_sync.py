@@ -12,8 +12,7 @@ import logging
 import traceback
 
 from openchrono.databuffer import DataBuffer
-from openchrono.arduino import SensorsArduino
-from openchrono.utils import linear_function_with_limit
+from openchrono.sensors import SensorManager, sensors_config
 
 logger = logging.getLogger(__name__)
 
@@ -29,11 +28,12 @@ VIDEOWIDTH = 1920
 @click.option('--data-filename', default='data.csv', help="Data filename (CSV file)")
 @click.option('--video-filename', default='video.h264', help="Video filename (open with omxplayer)")
 @click.option('--video-preview/--no-video-preview', default=True, help="Video preview")
-@click.option('--device', default='/dev/ttyUSB0', help='device')
-@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600')
+@click.option('--config', default='', help='Config file with sensors (default: ~/.openchrono.yaml if it exists)')
+@click.option('--device', default='/dev/ttyUSB0', help='device (without config file)')
+@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600 (without config file)')
 @click.option('--erase/--no-erase', default=False, help='Erase data (video and csv)')
 def main(vflip, hflip, video_stabilization, data_folder, data_filename, video_filename, video_preview, 
-    device, baudrate, erase):
+    config, device, baudrate, erase):
 
     logging.basicConfig(level=logging.INFO)
 
@@ -47,10 +47,11 @@ def main(vflip, hflip, video_stabilization, data_folder, data_filename, video_fi
             os.makedirs(data_folder)
 
 
-    sensors00 = SensorsArduino(device=device, baudrate=baudrate, adc_channels_number=2)
+    sensors = SensorManager.from_config(sensors_config(config, device, baudrate))
+    sensors.connect()
+    # only first channel of first sensor is recorded ('pos')
+    sensors00 = sensors[sensors.names[0]]
     logger.info("capabilities: %s" % sensors00.capabilities)
-    sensors00.connect()
-    sensors00.ADC[0].calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
 
     
     with picamera.PiCamera() as camera:
@@ -10,10 +10,12 @@ import datetime
 
 import logging
 import traceback
+import numpy as np
 
-from openchrono.databuffer import DataBuffer
-from openchrono.arduino import SensorsArduino
-from openchrono.utils import linear_function_with_limit
+from openchrono.databuffer import DataBuffer, BinaryDataBuffer, AsyncDataBuffer, recording_dtype, \
+    DeltaEncoder, DELTA_COLUMNS, delta_recording_dtype
+from openchrono.sensors import SensorManager, sensors_config
+from openchrono.utils import monotonic
 from openchrono.filename import FilenameFactory
 
 import pingo
@@ -128,7 +130,8 @@ VIDEO_WIDTH = 1920
 
 
 class RecordingTask(threading.Thread):
-    def __init__(self, camera_settings, sensors, led, filename, video_preview, erase, lag, time_to_sleep):
+    def __init__(self, camera_settings, sensors, led, filename, video_preview, erase, lag, time_to_sleep, data_format='csv',
+                 data_mode='value', keyframe_interval=1000):
         threading.Thread.__init__(self)
         
         self.camera = picamera.PiCamera()
@@ -145,8 +148,70 @@ class RecordingTask(threading.Thread):
         self.lag = lag
         self.time_to_sleep = time_to_sleep
         
+        self.data_format = data_format
+        # 'value': a row when value changed (calibrated value for CSV)
+        # 'delta': change-only rows of raw samples with sequence numbers and keyframes
+        self.data_mode = data_mode
+        self.keyframe_interval = keyframe_interval
+        
         self.active = False
     
+    def _create_data_buffer(self, channels):
+        columns = [column for column, ai in channels]
+        # raw values are stored in binary files (calibration tables are stored in header)
+        calibrations = dict((column, ai.calibration_table) for column, ai in channels)
+        if self.data_mode == 'delta':
+            if self.data_format == 'binary':
+                return BinaryDataBuffer(self.filename.data_binary, delta_recording_dtype(columns),
+                    calibrations=calibrations)
+            data = DataBuffer(self.filename.data, batch_size=1000, flush_interval=1.0)
+            data.columns = ["t", "frame"] + DELTA_COLUMNS + columns
+            return data
+        if self.data_format == 'binary':
+            return BinaryDataBuffer(self.filename.data_binary, recording_dtype(columns),
+                calibrations=calibrations)
+        else:
+            data = DataBuffer(self.filename.data, batch_size=1000, flush_interval=1.0)
+            data.columns = ["t", "frame"] + columns
+            return data
+
+    def _first_sample(self, source):
+        """Returns index of first sample which has values of every
+        sensors (values of a sensor are 0 before its first sample)"""
+        start = 0
+        for i in np.flatnonzero(~self._sensors_started):
+            rows = np.flatnonzero(source == i)
+            if len(rows) > 0:
+                self._sensors_started[i] = True
+                start = max(start, rows[0])
+            else:
+                start = len(source)
+        return start
+
+    def _prefixes(self, t, now, t_now, framenumber):
+        """Returns (t, frame) of each sample - monotonic timestamps of
+        samples are converted to UTC datetimes and samples taken before
+        previous loop are put in frame of previous loop"""
+        timestamps = (np.datetime64(now, 'us')
+            - np.round((t_now - t) * 1e6).astype('timedelta64[us]')).tolist()
+        frames = np.where(t <= self._t_prev, self._frame_prev, framenumber).tolist()
+        self._t_prev, self._frame_prev = t_now, framenumber
+        return list(zip(timestamps, frames))
+
+    def _changed_rows(self, raw_values, tables, prefixes, raw):
+        """Returns rows of samples whose calibrated values changed
+        (raw or calibrated values) - prefixes: (t, frame) of each sample"""
+        values = np.column_stack([table[raw_values[:, i]] for i, table in enumerate(tables)])
+        if len(values) == 0:
+            return []
+        previous = np.vstack([values[:1] if self._values_prev is None else self._values_prev, values[:-1]])
+        changed = (values != previous).any(axis=1)
+        if self._values_prev is None:
+            changed[0] = True
+        self._values_prev = values[-1:]
+        output = raw_values if raw else values
+        return [prefixes[i] + tuple(row) for i, row in zip(np.flatnonzero(changed), output[changed].tolist())]
+    
     def run(self):
         self.active = True
 
@@ -164,30 +229,60 @@ class RecordingTask(threading.Thread):
             time.sleep(self.lag)
         self.led.blink(times=0, on_delay=0.8, off_delay=0.2) # blink foreever
         
-        with DataBuffer(self.filename.data) as data:
-            data.columns = ["t", "frame", "pos"]
+        channels = self.sensors.channels()
+        # disk I/O is done by writer thread of AsyncDataBuffer
+        with AsyncDataBuffer(self._create_data_buffer(channels)) as data:
+            for column, ai in channels:
+                ai.save_calibration_table(self.filename.calibration(column))
+            tables = [ai.calibration_table for column, ai in channels]
+            raw = self.data_format == 'binary'
+            # sensors are read by their own thread - samples of every sensors
+            # are merged into a single time-ordered stream
+            samples = self.sensors.stream()
+            encoder = DeltaEncoder(self.keyframe_interval)
+            self._values_prev = None
+            self._sensors_started = np.zeros(len(self.sensors), dtype=bool)
+            self._t_prev, self._frame_prev = -np.inf, 0
             
             self.camera.start_recording(self.filename.video) #, inline_headers=False)
             logger.info("Recording to %s" % self.filename.video)
             while(self.active):
                 now = datetime.datetime.utcnow()
+                t_now = monotonic()
                 
                 #logger.info("data in the loop @ %s" % now)
                 
                 framenumber = self.camera.frame.index
                 #logger.info(framenumber)
                 
-                to_append = False
-                ai0 = self.sensors[0].ADC[0]
-                if self.sensors[0].update() and not ai0.has_same_value: #and ai0.has_new_data: #ai0.has_same_raw_value
-                    to_append = True
+                t, source, seq, raw_values = samples.read()
+                start = self._first_sample(source)
+                t, seq, raw_values = t[start:], seq[start:], raw_values[start:]
+                prefixes = self._prefixes(t, now, t_now, framenumber)
+                if self.data_mode == 'delta':
+                    # change-only rows (sequence numbers show lost samples)
+                    rows = encoder.encode(seq, raw_values, prefixes)
+                else:
+                    rows = self._changed_rows(raw_values, tables, prefixes, raw)
+                for row in rows:
+                    data.append(*row)
                 
-                if to_append:
-                    data.append(now, framenumber, ai0.value) # ai0.raw or ai0.value
+                try:
+                    self.sensors.check()
+                except Exception as e:
+                    # no more samples would be recorded
+                    logger.error("%s - stop recording" % e)
+                    self.active = False
+                    break
                 
                 time.sleep(self.time_to_sleep)
 
+            if self.data_mode == 'delta':
+                for row in encoder.flush():
+                    data.append(*row)
+            logger.info(" samples overwritten before being recorded: %d" % samples.lost)
             self._when_stopped()
+        logger.info(" data buffer: %s" % data.stats)
 
 
     def terminate(self):
@@ -217,7 +312,7 @@ class Settings(object):
 class RecorderApp(object):
     def __init__(self, filename, vflip, hflip, video_stabilization, 
                  video_preview, device, baudrate, erase, fps, height, width, 
-                 lag):
+                 lag, data_format='csv', data_mode='value', keyframe_interval=1000, sequence=False, config=None):
         self.filename = filename  # filename factory (to create filenames)
         
         self.board = pingo.detect.get_board()
@@ -248,18 +343,24 @@ class RecorderApp(object):
         
         self.lag = lag
         self.time_to_sleep = 0.01
+        self.data_format = data_format
+        self.data_mode = data_mode
+        self.keyframe_interval = keyframe_interval
         
         self.recording = False
         self.recording_task = None
         
-        self.sensors = []
-        
-        sensors_arduino = SensorsArduino(device=self.device, baudrate=self.baudrate, adc_channels_number=2)
-        logger.info("capabilities: %s" % sensors_arduino.capabilities)
-        sensors_arduino.connect()
-        sensors_arduino.ADC[0].calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
+        # sensors of config file (or a single Arduino on device)
+        sensors_conf = sensors_config(config, self.device, self.baudrate)
+        if sequence:
+            for sensor_config in sensors_conf["sensors"].values():
+                sensor_config["sequence"] = True
+        self.sensors = SensorManager.from_config(sensors_conf)
+        logger.info("columns: %s" % self.sensors.columns)
+        self.sensors.connect()
         
-        self.sensors.append(sensors_arduino)
+        # each sensor is read by its own thread (into its ring buffer of samples)
+        self.sensors.start()
 
     def switch_pressed(self):
         logger.debug("switch pressed")
@@ -275,7 +376,8 @@ class RecorderApp(object):
         print("Start recording")
         self.recording = True
         self.recording_task = RecordingTask(self.camera_settings, self.sensors, self.led, self.filename, 
-            self.video_preview, self.erase, self.lag, self.time_to_sleep)
+            self.video_preview, self.erase, self.lag, self.time_to_sleep, self.data_format,
+            self.data_mode, self.keyframe_interval)
         self.recording_task.start()
         if self.lag > 0:
             raise NotImplementedError("Experimental - buggy! when stop recording before lag expired")
@@ -326,6 +428,8 @@ class RecorderApp(object):
         
         self.switch.stop()
         
+        self.sensors.stop()
+        
         self.board.cleanup()
         
         logger.info("closed RecorderApp")
@@ -339,15 +443,20 @@ class RecorderApp(object):
 @click.option('--data-filename', default='data.csv', help="Data filename (CSV file)")
 @click.option('--video-filename', default='video.h264', help="Video filename (open with omxplayer)")
 @click.option('--video-preview/--no-video-preview', default=True, help="Video preview")
-@click.option('--device', default='/dev/ttyUSB0', help='device')
-@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600')
+@click.option('--config', default='', help='Config file with sensors (default: ~/.openchrono.yaml if it exists)')
+@click.option('--device', default='/dev/ttyUSB0', help='device (without config file)')
+@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600 (without config file)')
 @click.option('--erase/--no-erase', default=False, help='Erase data (video and csv)')
 @click.option('--fps', default=VIDEO_FPS, help='Frame per second (default: %d)' % VIDEO_FPS)
 @click.option('--height', default=VIDEO_HEIGHT, help='Video height (default: %d)' % VIDEO_HEIGHT)
 @click.option('--width', default=VIDEO_WIDTH, help='Video width (default: %d)' % VIDEO_WIDTH)
 @click.option('--lag', default=0, help='Lag (delay) - before recording')
+@click.option('--data-format', default='csv', type=click.Choice(['csv', 'binary']), help="Data format (binary: data.bin with raw values)")
+@click.option('--data-mode', default='value', type=click.Choice(['value', 'delta']), help="Data mode (delta: change-only raw samples with sequence numbers and keyframes)")
+@click.option('--keyframe-interval', default=1000, help='Maximum number of samples between 2 keyframes (delta mode)')
+@click.option('--sequence/--no-sequence', default=False, help='Frames of Arduino have a counter byte (SEND_SEQUENCE in sketch)')
 def main(vflip, hflip, video_stabilization, data_folder, data_filename, video_filename, video_preview, 
-    device, baudrate, erase, fps, height, width, lag):
+    config, device, baudrate, erase, fps, height, width, lag, data_format, data_mode, keyframe_interval, sequence):
   
     logging.basicConfig(level=logging.INFO)
 
@@ -356,7 +465,8 @@ def main(vflip, hflip, video_stabilization, data_folder, data_filename, video_fi
     filename = FilenameFactory(data_folder, data=data_filename, video=video_filename)
     
     app = RecorderApp(filename, vflip, hflip, video_stabilization, 
-        video_preview, device, baudrate, erase, fps, height, width, lag)
+        video_preview, device, baudrate, erase, fps, height, width, lag, data_format,
+        data_mode, keyframe_interval, sequence, config)
     
     app.loop()
     #app.recording = True
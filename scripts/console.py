@@ -8,38 +8,41 @@ import logging
 import traceback
 
 import openchrono
-from openchrono.arduino import SensorsArduino
-from openchrono.utils import linear_function_with_limit
+from openchrono.sensors import SensorManager, sensors_config
 
 
 logger = logging.getLogger(__name__)
 
 
 @click.command()
-@click.option('--device', default='/dev/ttyUSB0', help='device')
-@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600')
-def main(device, baudrate):
+@click.option('--config', default='', help='Config file with sensors (default: ~/.openchrono.yaml if it exists)')
+@click.option('--device', default='/dev/ttyUSB0', help='device (without config file)')
+@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600 (without config file)')
+def main(config, device, baudrate):
     logging.basicConfig(level=logging.INFO)
     
-    sensors00 = SensorsArduino(device=device, baudrate=baudrate, adc_channels_number=2)
-    print("capabilities: %s" % sensors00.capabilities)
-    sensors00.connect()
-    sensors00.ADC[0].calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
+    sensors = SensorManager.from_config(sensors_config(config, device, baudrate))
+    print("columns: %s" % sensors.columns)
+    sensors.connect()
+    sensors.start()
+    samples = sensors.stream()
 
     t_last = datetime.datetime.utcnow()
-    while True:
-        t = datetime.datetime.utcnow()
-        try:
-            if sensors00.update() and sensors00.ADC[0].has_new_data:
-                print(sensors00._bin_msg._data)
-                ai0 = sensors00.ADC[0]
-                y_raw = ai0.raw
-                y = ai0.value
-                logger.info("%s %s %s" % (t, y, t - t_last))
-        except Exception as e:
-            logger.error(traceback.format_exc())
-            #raise e
-        t_last = t
+    try:
+        while True:
+            t = datetime.datetime.utcnow()
+            try:
+                if len(samples.read()[0]) > 0:
+                    logger.info("%s %s %s" % (t, dict(sensors.snapshot()), t - t_last))
+                    t_last = t
+                time.sleep(0.01)
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                #raise e
+    except KeyboardInterrupt:
+        print("Cancelled by user (CTRL+C)")
+    finally:
+        sensors.stop()
 
 if __name__ == '__main__':
     main()
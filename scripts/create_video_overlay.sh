@@ -9,6 +9,9 @@ SCRIPTDIR=$(dirname $0)/
 
 echo "Creating Videos $SCRIPTDIR $INPUTDIR $OUTPUTDIR DONE"
 
+#create data video (frames are streamed to ffmpeg/avconv - no image files)
+#python ${SCRIPTDIR}video_overlay.py ${INPUTDIR} --video --filename-video-out ${OUTPUTDIR}data.mp4
+
 #create data images
 echo "  Creating data images"
 #python ${SCRIPTDIR}video_overlay.py ${INPUTDIR}
@@ -25,6 +28,8 @@ echo "  Create data video"
 # Don't forget to install avconv using
 # sudo apt-get install libav-tools
 #avconv -r 10 -i ${INPUTDIR}images/%06d.jpg -r 10 -vcodec libx264 -crf 20 -g 15 ${OUTPUTDIR}data.mp4
+# only distinct images are stored - repeated frames are given by frames.ffconcat
+#ffmpeg -f concat -i ${INPUTDIR}images/frames.ffconcat -vsync cfr -r 25 -vcodec libx264 -crf 20 -g 15 -pix_fmt yuv420p ${OUTPUTDIR}data.mp4
 
 #echo "  Deleting data images"
 #rm ${INPUTDIR}images/*.jpg
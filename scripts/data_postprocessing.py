@@ -11,72 +11,182 @@ import matplotlib.pyplot as plt
 
 COL_T = 't'
 COL_FRAME = 'frame'
+COL_SEQ = 'seq'
 
 from openchrono.filename import FilenameFactory
+from openchrono.loader import load_recording, iter_dataframes, parse_datetime
+
+
+def _t_ns(s_t):
+    """Returns a datetime Series as a int64 ns array"""
+    return s_t.values.astype('datetime64[ns]').view(np.int64)
+
+
+class PostprocessingState(object):
+    """State carried across chunks of a recording"""
+    def __init__(self):
+        self.t_first = None  # int64 ns of first row (offset of 't' of frames)
+        self.t_origin = None  # int64 ns of first output row (for 't0')
+        self.t_last = None  # int64 ns of last output row (for 'td')
+        self.last = None  # last frame with measures (to interpolate 't' and forward fill sensors)
+
+
+def _add_td_t0(df, t_ns, state):
+    """Add 'td' (delta with previous row) and 't0' (delta with first row)
+    columns in seconds"""
+    td = np.empty(len(t_ns), dtype=np.float64)
+    td[:1] = np.nan if state.t_last is None else (t_ns[:1] - state.t_last) / 1e9
+    td[1:] = np.diff(t_ns) / 1e9
+    df['td'] = td
+    if state.t_origin is None and len(t_ns) > 0:
+        state.t_origin = t_ns[0]
+    df['t0'] = (t_ns - state.t_origin) / 1e9 if len(t_ns) > 0 else np.zeros(0)
+    if len(t_ns) > 0:
+        state.t_last = t_ns[-1]
+    return df
+
+def _postprocessing_frame(df, col_t, sensors, state):
+    """Returns one row per frame (and 't' as int64 ns)
+    
+    Every rows of a frame must be in df
+    """
+    t_ns = _t_ns(df[col_t])
+    # mean of rows with same frame (t relative to first row to keep ns precision)
+    df_grp = df[sensors].assign(**{col_t: t_ns - state.t_first, COL_FRAME: df[COL_FRAME].values}) \
+        .groupby(COL_FRAME, sort=True).mean()
+    prepended = state.last is not None
+    if prepended:
+        # previous frame (previous chunk) is needed for missing frames
+        df_grp = pd.concat([state.last, df_grp])
+    state.last = df_grp.iloc[-1:]
+    frames = df_grp.index.values
+    idx = pd.Index(np.arange(frames.min(), frames.max() + 1), name=COL_FRAME)
+
+    # missing frames: 't' is linearly interpolated (int64 ns) and sensors are forward filled
+    t_ns = np.round(np.interp(idx.values, frames, df_grp[col_t].values)).astype(np.int64) + state.t_first
+    df = df_grp[sensors].reindex(idx).ffill()
+    df.insert(0, col_t, pd.to_datetime(t_ns, unit='ns'))
+    df['measures'] = np.isin(idx.values, frames)
+    if prepended:
+        # remove previous frame (already output)
+        df, t_ns = df.iloc[1:], t_ns[1:]
+    return df, t_ns
+
+def _postprocessing_empty(df, col_t, sensors, index):
+    """Returns output of a recording without rows (no row, same columns)"""
+    if index in ['frame', 'f']:
+        df = pd.DataFrame(columns=[col_t] + list(sensors) + ['measures'], index=pd.Index([], name=COL_FRAME))
+    elif index in ['time', 't']:
+        df = df.set_index(col_t)
+    else:
+        raise NotImplementedError("%r not supported" % index)
+    return df.assign(td=np.zeros(0), t0=np.zeros(0))
 
-
-def postprocessing(df, col_t=COL_T, index='frame'):
-    df[COL_T] = pd.to_datetime(df[COL_T])
-    sensors = df.columns.drop([COL_T, COL_FRAME]) # every columns except 't' and 'frame' (sensors)
+def _postprocessing(df, col_t, index, state):
+    df[col_t] = parse_datetime(df[col_t])
+    sensors = df.columns.drop([col_t, COL_FRAME, COL_SEQ], errors='ignore') # every columns except 't', 'frame' and 'seq' (sensors)
+    if len(df) == 0:
+        return _postprocessing_empty(df, col_t, sensors, index), sensors
+    if state.t_first is None:
+        state.t_first = _t_ns(df[col_t])[0]
 
     if index in ['frame', 'f']:
-        s_null_t = df[COL_T].isnull()
-        df[COL_T] = df[COL_T].astype(np.int64)
-        frame_min = df['frame'].min()
-        frame_max = df['frame'].max()
-        df_grp = df.groupby('frame').mean()
-        df_grp['measures'] = True
-        idx = pd.Index(np.arange(frame_min, frame_max + 1), name='frame')
-        df = pd.DataFrame(columns = df_grp.columns, index=idx)
-        df.loc[df_grp.index, :] = df_grp
-
-        # interpolate NaT values in 't' column with a linear regression
-        #df[COL_T] = df[COL_T].fillna(method='ffill')
-        # ToDo:
-        # http://stackoverflow.com/questions/33921795/fill-timestamp-nat-with-a-linear-interpolation/33922824?noredirect=1#comment55606782_33922824
-        # https://github.com/pydata/pandas/issues/11701
-        df[COL_T] = df[COL_T].astype(np.float64)
-        df.loc[s_null_t, COL_T] = np.nan
-        df[COL_T] = df[COL_T].interpolate()
-        df[COL_T] = pd.to_datetime(df[COL_T] / 1000, unit='us')
-
-        df['measures'] = df['measures'].fillna(False)
-        df[sensors] = df[sensors].fillna(method='ffill')
+        df, t_ns = _postprocessing_frame(df, col_t, sensors, state)
 
     elif index in ['time', 't']:
-        pass
+        t_ns = _t_ns(df[col_t])
 
     else:
         raise NotImplementedError("%r not supported" % index)
 
-    df['td'] = df[COL_T] - df[COL_T].shift(1)
-    td_unit = np.timedelta64(1, 's')
-    df['td'] = df['td'].map(lambda x: x / td_unit)
-    df['t0'] = df[COL_T].map(lambda x: x - df[COL_T][0])
-    df['t0'] = df['t0'].map(lambda x: x / td_unit)
+    df = _add_td_t0(df, t_ns, state)
     if index in ['time', 't']:
-        df = df.set_index(COL_T)
+        df = df.set_index(col_t)
     return df, sensors
 
+def postprocessing(df, col_t=COL_T, index='frame'):
+    return _postprocessing(df, col_t, index, PostprocessingState())
+
+def postprocessing_chunked(chunks, col_t=COL_T, index='frame'):
+    """Post-process an iterable of DataFrames (chunks of a recording)
+    and yields post-processed DataFrames incrementally
+    
+    Output is the same as postprocessing of the whole recording but
+    memory is bounded by chunk size (state is carried across chunks)
+    """
+    state = PostprocessingState()
+    pending = None  # rows of last frame (might continue in next chunk)
+    for df in chunks:
+        if pending is not None:
+            df = pd.concat([pending, df], ignore_index=True)
+        if len(df) == 0:
+            continue
+        if index in ['frame', 'f']:
+            is_last_frame = (df[COL_FRAME] == df[COL_FRAME].iloc[-1]).values
+            pending, df = df[is_last_frame], df[~is_last_frame]
+        if len(df) > 0:
+            yield _postprocessing(df.copy(), col_t, index, state)[0]
+    if pending is not None and len(pending) > 0:
+        yield _postprocessing(pending.copy(), col_t, index, state)[0]
+
 @click.command()
 @click.argument('directory')
 @click.option('--max-rows', default=20, help='Pandas display.max_rows')
 @click.option('--filename-out', default='data_postprocessed.csv', help='Filename output')
 @click.option('--index', default='frame', help="Set index to 'time' or to 'frame'")
-def main(directory, max_rows, filename_out, index):
+@click.option('--chunksize', default=0, help='Process recording by blocks of rows (0: whole recording)')
+def main(directory, max_rows, filename_out, index, chunksize):
     filename = FilenameFactory(directory)
-    filename_in = filename.data
     index = index.lower()
-    print("Reading %r" % filename_in)
     pd.set_option('display.max_rows', max_rows)
 
-    df = pd.read_csv(filename_in)
+    if chunksize > 0:
+        filename_out = filename.create(filename_out)
+        rows = postprocess_directory(directory, filename_out, index, chunksize)
+        print("%d rows written to %r" % (rows, filename_out))
+        return
+
+    recording = load_recording(directory)
+    print("Reading %r" % recording.filename)
+    if recording.lost is not None:
+        print("%d samples lost" % recording.lost)
+    df = recording.to_dataframe()
     df, sensors = postprocessing(df, COL_T, index)
 
     print(df)
     filename_out = filename.create(filename_out)
     df.to_csv(filename_out)
 
+def postprocess_directory(directory, filename_out, index='frame', chunksize=0):
+    """Post-process a recording directory and write output (filename_out)
+    - returns number of rows written
+
+    With chunksize > 0, recording is processed by blocks (memory bounded
+    by chunksize) and output is written incrementally
+
+    Output is written to a temporary file which is renamed when
+    complete (a failed or interrupted run doesn't leave a partial output)
+    """
+    filename_tmp = filename_out + '.tmp'
+    try:
+        if chunksize <= 0:
+            df, sensors = postprocessing(load_recording(directory).to_dataframe(), COL_T, index)
+            df.to_csv(filename_tmp)
+            rows = len(df)
+        else:
+            chunks = iter_dataframes(directory, chunksize)
+            rows = 0
+            with open(filename_tmp, 'w') as fd:
+                for i, df in enumerate(postprocessing_chunked(chunks, COL_T, index)):
+                    df.to_csv(fd, header=(i == 0))
+                    rows += len(df)
+    except BaseException:
+        if os.path.exists(filename_tmp):
+            os.remove(filename_tmp)
+        raise
+    os.rename(filename_tmp, filename_out)
+    return rows
+
 
 if __name__ == '__main__':
     main()
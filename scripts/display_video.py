@@ -15,8 +15,9 @@ import pandas as pd
 from PyQt4 import QtGui, QtCore, uic
 
 import pyqtgraph as pg
-from data_postprocessing import (get_data_filename, 
-        get_video_filename, postprocessing)
+from data_postprocessing import postprocessing
+from openchrono.filename import FilenameFactory
+from openchrono.loader import load_recording
 
 logger = logging.getLogger(__name__)
 
@@ -30,11 +31,12 @@ class DisplayVideoMainWindow(QtGui.QMainWindow):
 
         self.cal_plot = pg.PlotWidget()
         self.setWindowTitle(self.directory);
-        self.data_filename = get_data_filename(directory)
-        self.video_filename = get_video_filename(directory)
+        recording = load_recording(directory)
+        self.data_filename = recording.filename
+        self.video_filename = FilenameFactory(directory).video
 
         logger.info("Reading %r" % self.data_filename)
-        self.df = pd.read_csv(self.data_filename)
+        self.df = recording.to_dataframe()
         self.df, self.sensors = postprocessing(self.df, 't', 'frame')
         frame_min, frame_max = self.df.index.min(), self.df.index.max()
         
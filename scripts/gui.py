@@ -11,9 +11,8 @@ import numpy as np
 from PyQt4 import QtGui, QtCore, uic
 
 
-from openchrono import arduino
+from openchrono.sensors import SensorManager, sensors_config
 from openchrono.utils import limit
-from openchrono.utils import linear_function_with_limit
 
 import pyqtgraph as pg
 
@@ -37,7 +36,7 @@ class MainWindow(QtGui.QMainWindow):
     def plot_calibrate_func(self):
         pen = pg.mkPen('r', style=QtCore.Qt.SolidLine)
         N = 2**self.ai.bits_resolution  # ADC resolution = 10 bits = 2**10 = 1024
-        self.cal_plot.plot(np.arange(1024), [self.ai._calibrate_func(i) for i in range(N)], pen=pen)
+        self.cal_plot.plot(np.arange(N), self.ai.calibration_table, pen=pen)
         #self.dot_plot.plot()
         self.dot = self.cal_plot.plot([self.ai.raw], [self.ai.value], pen=None, symbol='o')
 
@@ -57,6 +56,7 @@ class MainWindow(QtGui.QMainWindow):
 
 class MyApplication(QtGui.QApplication):
     def __init__(self, *args, **kwargs):
+        config = kwargs.pop('config')
         device = kwargs.pop('device')
         baudrate = kwargs.pop('baudrate')
         super(MyApplication, self).__init__(*args, **kwargs)
@@ -65,11 +65,12 @@ class MyApplication(QtGui.QApplication):
         self.t_last = self.t
 
         #self.sensors = 50.0
-        self.sensors00 = arduino.SensorsArduino(device=device, baudrate=baudrate, adc_channels_number=2, update_error_exception=False)
-        self.sensors00.connect()
+        self.sensors = SensorManager.from_config(sensors_config(config, device, baudrate))
+        self.sensors.connect()
+        # first channel of first sensor is displayed
+        self.sensors00 = self.sensors[self.sensors.names[0]]
         ai = self.sensors00.ADC[0]
-        ai.calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
-        #ai.calibrate(lambda value: linear_function_with_limit(value, 0.0, 2**ai.bits_resolution - 1, 0.0, 100.0))
+        #ai.calibrate(LinearWithLimit(0.0, 2**ai.bits_resolution - 1, 0.0, 100.0))
         
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update)
@@ -92,9 +93,10 @@ class MyApplication(QtGui.QApplication):
             self.t_last = self.t
 
 @click.command()
-@click.option('--device', default='/dev/ttyUSB0', help='device')
-@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600')
-def main(device, baudrate):
+@click.option('--config', default='', help='Config file with sensors (default: ~/.openchrono.yaml if it exists)')
+@click.option('--device', default='/dev/ttyUSB0', help='device (without config file)')
+@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600 (without config file)')
+def main(config, device, baudrate):
     logging.basicConfig(level=logging.INFO)
 
     # Set PyQtGraph colors
@@ -105,7 +107,7 @@ def main(device, baudrate):
     pg.setConfigOptions(antialias=True)
   
 
-    app = MyApplication(sys.argv, device=device, baudrate=baudrate)
+    app = MyApplication(sys.argv, config=config, device=device, baudrate=baudrate)
     
     sys.exit(app.exec_())
 
@@ -10,23 +10,26 @@ import logging
 import traceback
 from numpy_buffer import RingBuffer
 
-from openchrono.arduino import SensorsArduino
-from openchrono.utils import linear_function_with_limit
+from openchrono.sensors import SensorManager, sensors_config
+from openchrono.utils import monotonic
 
 
 logger = logging.getLogger(__name__)
 
 
 @click.command()
-@click.option('--device', default='/dev/ttyUSB0', help='device')
-@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600')
-def main(device, baudrate):
+@click.option('--config', default='', help='Config file with sensors (default: ~/.openchrono.yaml if it exists)')
+@click.option('--device', default='/dev/ttyUSB0', help='device (without config file)')
+@click.option('--baudrate', default=57600, help='Baudrate (9600 14400 19200 28800 38400 57600 115200) - default to 57600 (without config file)')
+def main(config, device, baudrate):
     logging.basicConfig(level=logging.INFO)
     
-    sensors00 = SensorsArduino(device=device, baudrate=baudrate, adc_channels_number=2)
+    sensors = SensorManager.from_config(sensors_config(config, device, baudrate))
+    sensors.connect()
+    # first channel of first sensor is plotted
+    sensors00 = sensors[sensors.names[0]]
     print("capabilities: %s" % sensors00.capabilities)
-    sensors00.connect()
-    sensors00.ADC[0].calibrate(lambda value: linear_function_with_limit(value, 520.0, 603.0, 0.0, 100.0))
+    cursor = sensors00.samples.cursor()
         
     maxlen = 100
     data_x = RingBuffer(maxlen, datetime.datetime.utcnow(), dtype=datetime.datetime)
@@ -43,13 +46,16 @@ def main(device, baudrate):
     while True:
         t = datetime.datetime.utcnow()
         try:
-            if sensors00.update() and sensors00.ADC[0].has_new_data:
-                print(sensors00._bin_msg._data)
-                y = sensors00.ADC[0].value
-                #y = limit(y, 1800.0, 24000.0, 0.0, 100.0)
-                logger.info("%s %s %s" % (t, y, t - t_last))
-                data_x.append(t)
-                data_y.append(y)
+            if sensors00.update():
+                # drain every samples received since last update (lossless)
+                t_samples, seq, raw = cursor.read()
+                now = monotonic()
+                values = sensors00.ADC[0].calibrated(raw[:, 0])
+                for t_sample, y in zip(t_samples, values):
+                    #y = limit(y, 1800.0, 24000.0, 0.0, 100.0)
+                    data_x.append(t - datetime.timedelta(seconds=now - t_sample))
+                    data_y.append(y)
+                logger.info("%s %s %s (lost: %d)" % (t, y, t - t_last, cursor.lost))
                 line.set_xdata(data_x.all[::-1])
                 xmin, xmax = data_x.min(), data_x.max()
                 if xmax > xmin:
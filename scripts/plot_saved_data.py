@@ -8,6 +8,8 @@ import pandas as pd
 
 import matplotlib.pyplot as plt
 
+from openchrono.loader import load_recording
+
 COL_T = 't'
 
 @click.command()
@@ -20,12 +22,11 @@ COL_T = 't'
 @click.option('--style-dots', default='g+', help='Style')
 def main(directory, filename, max_rows, plots, stacked, style_line, style_dots):
     directory = os.path.expanduser(directory)
-    filename = os.path.join(directory, filename)
-    print("Reading %r" % filename)
     pd.set_option('display.max_rows', max_rows)
 
-    df = pd.read_csv(filename)
-    df[COL_T] = pd.to_datetime(df[COL_T])
+    recording = load_recording(directory, filename)
+    print("Reading %r" % recording.filename)
+    df = recording.to_dataframe()
     df = df.set_index(COL_T)
     print(df)
 
@@ -5,30 +5,361 @@ import click
 
 import os
 import glob
+import json
+import math
+import bisect
+import hashlib
 import logging
+import subprocess
+import multiprocessing
+import numpy as np
 import pandas as pd
 
-from collections import namedtuple
+from collections import OrderedDict
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
 
 from PIL import Image, ImageFont, ImageDraw
 
+from openchrono.loader import load_data
+from openchrono.formatter import DataFormatter
+
 COL_T = 't'
+COL_FRAME = 'frame'
+# columns of recordings (and of post-processed data) which are not sensors
+COLUMNS_NOT_SENSORS = [COL_T, COL_FRAME, 'seq', 't0', 'td', 'measures']
 
 logger = logging.getLogger(__name__)
 
+ENCODERS = ['ffmpeg', 'avconv']
+ENCODER_OPTIONS = ['-vcodec', 'libx264', '-crf', '20', '-g', '15', '-pix_fmt', 'yuv420p']
+
 def draw_point(imagedraw, x, y, width, color):
     imagedraw.ellipse((x - width / 2, y - width / 2, x + width / 2, y + width / 2), color)
 
+def text_size(imagedraw, text, font):
+    """Returns (width, height) of text drawn at (0, 0)
+    (like ImageDraw.textsize which was removed from Pillow 10)"""
+    left, top, right, bottom = imagedraw.textbbox((0, 0), text, font=font)
+    return right, bottom
+
 def draw_boxed_text(imagedraw, x, y, width, height, text, text_font, text_color, box_color):
     #draw box
     y_offset = 2
     imagedraw.rectangle((x, y + y_offset, x + width, y + y_offset + height), outline=box_color, fill=box_color)
     #get size of text
-    textWidth,textHeight = imagedraw.textsize(text, font=text_font)
+    textWidth,textHeight = text_size(imagedraw, text, text_font)
     #draw text, putting the text in the middle of the box
     imagedraw.text((x + 5, y + ((height - textHeight) / 2)), text, font=text_font, fill=text_color)
 
 
+class GlyphAtlas(object):
+    """Text renderer for monospace fonts: each character is rasterized
+    once (as a mask tile) and text is drawn by pasting tiles
+    
+    Tiles depend on fractional part of text position (like FreeType
+    rendering) so text is drawn like ImageDraw.text
+    """
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.advance = int(font.getlength("0"))
+        ascent, descent = font.getmetrics()
+        self._pad = self.advance
+        self._size = (self.advance + 2 * self._pad, ascent + descent + 2 * self._pad)
+        self._tiles = {}
+
+    @staticmethod
+    def is_monospace(font, chars="0123456789.:-+ abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"):
+        return len(set(font.getlength(c) for c in chars)) == 1
+
+    def _tile(self, c, fx, fy):
+        """Returns (mask, (dx, dy)) of a character (mask is None for blank characters)"""
+        key = (c, fx, fy)
+        try:
+            return self._tiles[key]
+        except KeyError:
+            pass
+        mask = Image.new("L", self._size, 0)
+        ImageDraw.Draw(mask).text((self._pad + fx, self._pad + fy), c, font=self.font, fill=255)
+        bbox = mask.getbbox()
+        if bbox is None:
+            tile = (None, (0, 0))
+        else:
+            tile = (mask.crop(bbox), (bbox[0] - self._pad, bbox[1] - self._pad))
+        self._tiles[key] = tile
+        return tile
+
+    def text(self, image, xy, text):
+        """Draw text on image at position xy"""
+        x, y = xy
+        fx, fy = math.modf(x)[0], math.modf(y)[0]
+        x, y = int(x), int(y)
+        for i, c in enumerate(text):
+            mask, (dx, dy) = self._tile(c, fx, fy)
+            if mask is not None:
+                image.paste(self.color, (x + i * self.advance + dx, y + dy), mask)
+
+
+def find_encoder():
+    """Returns path of ffmpeg (or avconv) - None if no encoder is installed"""
+    for name in ENCODERS:
+        path = which(name)
+        if path is not None:
+            return path
+    return None
+
+
+class FrameMap(object):
+    """Run-length map of video frames to their source image
+    
+    Each run is [start, stop, source]: frames start..stop-1 display
+    image of frame source (a negative source is the background image)
+
+    >>> frame_map = FrameMap()
+    >>> for framenumber, source in [(0, -1), (1, 1), (2, 1), (3, 1), (4, 4)]:
+    ...     frame_map.add(framenumber, source)
+    >>> frame_map.runs
+    [[0, 1, -1], [1, 4, 1], [4, 5, 4]]
+    >>> frame_map.source(3)
+    1
+    """
+    def __init__(self, runs=None):
+        self.runs = [] if runs is None else [list(run) for run in runs]
+
+    def __len__(self):
+        """Number of frames"""
+        return sum(stop - start for start, stop, source in self.runs)
+
+    def add(self, framenumber, source):
+        if self.runs:
+            run = self.runs[-1]
+            if run[1] == framenumber and run[2] == source:
+                run[1] += 1
+                return
+        self.runs.append([framenumber, framenumber + 1, source])
+
+    def update(self, other):
+        """Merge runs of an other frame map (frames of both maps must not overlap)"""
+        runs, self.runs = sorted(self.runs + other.runs), []
+        for start, stop, source in runs:
+            if self.runs and self.runs[-1][1] == start and self.runs[-1][2] == source:
+                self.runs[-1][1] = stop
+            else:
+                self.runs.append([start, stop, source])
+
+    def resolve(self, images):
+        """Replace sources which have no image (repeated frames of
+        an other frame range) by their own source - an unknown
+        source is replaced by background (-1)
+        
+        >>> frame_map = FrameMap([[0, 2, 0], [2, 3, 1], [3, 4, 2], [4, 5, 9]])
+        >>> frame_map.resolve(set([0]))
+        >>> frame_map.runs
+        [[0, 4, 0], [4, 5, -1]]
+        """
+        def resolve(source):
+            while source >= 0 and source not in images:
+                try:
+                    source = self.source(source)
+                except KeyError:
+                    return -1
+            return source
+        runs = [[start, stop, resolve(source)] for start, stop, source in self.runs]
+        self.runs = []
+        self.update(FrameMap(runs))
+
+    def source(self, framenumber):
+        starts = [run[0] for run in self.runs]
+        i = bisect.bisect_right(starts, framenumber) - 1
+        if i < 0 or framenumber >= self.runs[i][1]:
+            raise KeyError(framenumber)
+        return self.runs[i][2]
+
+    def __iter__(self):
+        """Yields (framenumber, source) of every frames"""
+        for start, stop, source in self.runs:
+            for framenumber in range(start, stop):
+                yield framenumber, source
+
+    def save(self, filename):
+        with open(filename, 'w') as fd:
+            json.dump({"runs": self.runs}, fd)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fd:
+            return cls(json.load(fd)["runs"])
+
+    def save_ffconcat(self, filename, source_filename, fps):
+        """Write a ffmpeg concat list (each source image once with
+        duration of its run) - use it with:
+        ffmpeg -f concat -i frames.ffconcat -vsync cfr -r fps ..."""
+        with open(filename, 'w') as fd:
+            fd.write("ffconcat version 1.0\n")
+            for start, stop, source in self.runs:
+                fd.write("file '%s'\nduration %.6f\n" % (source_filename(source), (stop - start) / float(fps)))
+            if self.runs:
+                # last image is repeated (else its duration is ignored)
+                fd.write("file '%s'\n" % source_filename(self.runs[-1][2]))
+
+
+class ImageFilesSink(object):
+    """Store frames as JPEG files into a directory - a repeated frame
+    has no file, it's only recorded into a frame map (frame -> image)
+    
+    With a manifest (frame -> key of existing image), images whose
+    key didn't change are kept and others files are replaced
+    (resume mode)
+    """
+    def __init__(self, directory_images, images_fmt, manifest=None):
+        self.directory_images = directory_images
+        self.images_fmt = images_fmt
+        self.manifest = manifest
+        self.frames = {}  # frame -> key of image written
+        self.frame_map = FrameMap()
+        self.invalidated = set()  # frames removed from manifest
+        self.reused = 0
+
+    def _filename(self, framenumber):
+        return os.path.join(self.directory_images, self.images_fmt % framenumber)
+
+    def _remove(self, filename):
+        if os.path.lexists(filename):
+            os.remove(filename)
+
+    def _invalidate(self, framenumber):
+        """Image of a previous run (if any) is not valid anymore"""
+        self.manifest.pop(framenumber, None)
+        self.invalidated.add(framenumber)
+
+    def is_up_to_date(self, framenumber, key):
+        """Returns True when image of this frame exists with same key"""
+        if self.manifest is None or self.manifest.get(framenumber) != key:
+            return False
+        filename_image = self._filename(framenumber)
+        if not os.path.isfile(filename_image) or os.path.islink(filename_image):
+            return False
+        self.frames[framenumber] = key
+        self.frame_map.add(framenumber, framenumber)
+        self.reused += 1
+        return True
+
+    def write(self, framenumber, image, key=None):
+        filename_image = self._filename(framenumber)
+        if self.manifest is not None:
+            self._invalidate(framenumber)
+            self._remove(filename_image)
+        logger.debug("Create %r" % filename_image)
+        image.save(filename_image, "JPEG", quality=100)
+        self.frames[framenumber] = key
+        self.frame_map.add(framenumber, framenumber)
+
+    def repeat(self, framenumber, framenumber_source):
+        if self.manifest is not None:
+            # image of a previous run (if any) is removed with stale images
+            self._invalidate(framenumber)
+        self.frame_map.add(framenumber, framenumber_source)
+
+    def close(self):
+        pass
+
+
+class EncoderPipeSink(object):
+    """Stream raw RGB frames to standard input of an encoder process
+    (ffmpeg or avconv) - a repeated frame is written again"""
+    def __init__(self, filename_out, size, fps, encoder, encoder_options=None, background=None):
+        if encoder_options is None:
+            encoder_options = ENCODER_OPTIONS
+        width, height = size
+        cmd = [encoder, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-'] \
+            + list(encoder_options) + ['-r', str(fps), filename_out]
+        logger.info("Run %s" % ' '.join(cmd))
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        # frame written for frames before first image
+        if background is None:
+            background = Image.new("RGB", size)
+        self._frame = background.tobytes()
+        self.frames_count = 0
+
+    def is_up_to_date(self, framenumber, key):
+        return False
+
+    def _write(self):
+        self.process.stdin.write(self._frame)
+        self.frames_count += 1
+
+    def write(self, framenumber, image, key=None):
+        self._frame = image.tobytes()
+        self._write()
+
+    def repeat(self, framenumber, framenumber_source):
+        self._write()
+
+    def close(self):
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise RuntimeError("Encoder failed (returncode=%d)" % returncode)
+
+
+class RecordColumns(object):
+    """Records as NumPy columns - value texts of a column are formatted
+    in bulk when they are first needed"""
+    def __init__(self, columns, format_column):
+        self.columns = columns  # OrderedDict key -> array
+        self._format_column = format_column
+        self._texts = {}
+
+    @property
+    def fields(self):
+        return tuple(self.columns.keys())
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def text(self, key, index):
+        try:
+            texts = self._texts[key]
+        except KeyError:
+            texts = self._texts[key] = self._format_column(key, self.columns[key])
+        return texts[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield ColumnRecord(self, index)
+
+
+class ColumnRecord(object):
+    """A record (row) of RecordColumns - values are available as attributes"""
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    @property
+    def _fields(self):
+        return self._columns.fields
+
+    def __getattr__(self, key):
+        try:
+            return self._columns.columns[key][self._index]
+        except KeyError:
+            raise AttributeError(key)
+
+    def text(self, key):
+        """Returns formatted value of key"""
+        return self._columns.text(key, self._index)
+
+    def __repr__(self):
+        return "Record(%s)" % ", ".join("%s=%r" % (key, getattr(self, key)) for key in self._fields)
+
+
 class VideoOverlay(object):
     DATAFRAME_WIDTH = 546 #1920 #250
     DATAFRAME_HEIGHT = 800 #1080 #800
@@ -64,8 +395,18 @@ class VideoOverlay(object):
         self.filename_video_out = os.path.join(directory, 'video_overlay.h264')
         
     def _init_images(self, directory):
-        # create images directory or remove images
         self.directory_images = os.path.join(directory, 'images')
+        
+        # set images format
+        self.images_fmt = "%06d.jpg"
+        self.filename_manifest = os.path.join(self.directory_images, 'manifest.json')
+        self.filename_frame_map = os.path.join(self.directory_images, 'frame_map.json')
+        self.filename_ffconcat = os.path.join(self.directory_images, 'frames.ffconcat')
+        self.filename_background = 'background.jpg'
+
+    def _clear_images(self):
+        # create images directory or remove images
+        # (only needed when images are stored as files)
         if not os.path.exists(self.directory_images):
             # create images directory
             os.makedirs(self.directory_images)
@@ -73,68 +414,201 @@ class VideoOverlay(object):
             # remove images previously created
             for filename in glob.glob(os.path.join(self.directory_images, "*.jpg")):
                 os.remove(filename)
-        
-        # set images format
-        self.images_fmt = "%06d.jpg"
+
+    def _load_manifest(self):
+        """Returns frame -> key of images previously created"""
+        try:
+            with open(self.filename_manifest) as fd:
+                frames = json.load(fd)["frames"]
+        except (IOError, OSError, ValueError, KeyError):
+            return {}
+        return dict((int(framenumber), key) for framenumber, key in frames.items())
+
+    def _save_manifest(self, manifest):
+        filename_tmp = self.filename_manifest + '.tmp'
+        with open(filename_tmp, 'w') as fd:
+            json.dump({"frames": dict((str(framenumber), key) for framenumber, key in manifest.items())}, fd)
+        os.rename(filename_tmp, self.filename_manifest)
+
+    def _source_filename(self, framenumber_source):
+        """Returns filename (in images directory) of a source image"""
+        if framenumber_source < 0:
+            return self.filename_background
+        return self.images_fmt % framenumber_source
+
+    def _save_frame_map(self, frame_map, fps):
+        """Save frame map (and ffmpeg concat list) of images"""
+        if any(source < 0 for start, stop, source in frame_map.runs):
+            image = self._create_Image_and_ImageDraw()[0]
+            image.save(os.path.join(self.directory_images, self.filename_background), "JPEG", quality=100)
+        frame_map.save(self.filename_frame_map)
+        frame_map.save_ffconcat(self.filename_ffconcat, self._source_filename, fps)
+
+    def _remove_stale_images(self, frames):
+        """Remove images of frames which were not created by last run"""
+        for filename in os.listdir(self.directory_images):
+            name, ext = os.path.splitext(filename)
+            if ext == '.jpg' and name.isdigit() and int(name) not in frames:
+                os.remove(os.path.join(self.directory_images, filename))
             
     def _init_pil(self):
         self.font = ImageFont.truetype(self.FONT_PATH, self.FONT_SIZE)
+        self._static = None  # static layer (created with first record)
         
+    def __getstate__(self):
+        # PIL font can't be pickled (it's created again by _init_pil in worker process)
+        state = self.__dict__.copy()
+        for key in ['font', '_stop_frames', '_static', '_canvas', '_canvas_draw', '_atlas']:
+            state.pop(key, None)
+        return state
+
     @property
     def records(self):
-        """Returns an iterator with a namedtuple Record like: 
+        """Returns an iterator of records like: 
         
         Record(
-            t=Timestamp('2015-11-21 14:46:55.161898'), 
+            t=numpy.datetime64('2015-11-21T14:46:55.161898000'), 
             frame=318, 
             position=34.9397590361
- + date[:16]       )
+        )
+        """
+        return iter(self._records())
+
+    def _records(self, start=None, stop=None, framenumber_prev=None):
+        """Returns RecordColumns of rows start:stop
+        
+        With framenumber_prev, only first row of each new frame
+        (greater than every previous frames) is kept
+        """
+        recording = load_data(self.filename_data_in)
+        if start is not None or stop is not None:
+            recording = recording.slice(start, stop)
+        fields = [COL_T] + [key for key in recording.columns if key != COL_T]
+        columns = OrderedDict((key, recording.column(key)) for key in fields)
+        if framenumber_prev is not None and len(recording) > 0:
+            frames = columns['frame']
+            frames_prev = np.maximum.accumulate(np.concatenate([[framenumber_prev], frames[:-1]]))
+            rows = frames > frames_prev
+            columns = OrderedDict((key, values[rows]) for key, values in columns.items())
+        return RecordColumns(columns, self._format_column)
+
+    def _format_column(self, key, values):
+        """Returns value texts of a whole column
+        
+        This method might be overload to customize drawing
         """
-        logger.info("Reading %r" % self.filename_data_in)
-
-        df = pd.read_csv(self.filename_data_in)
-        df[COL_T] = pd.to_datetime(df[COL_T])
-        df = df.set_index(COL_T)
-        columns = tuple([COL_T] + list(df.columns))
-        Record = namedtuple('Record', columns)
-        for dat in df.itertuples():
-            record = Record(*dat)
-            yield(record)
+        return self.data_formatter.format_column(key, values)
     
+    def sensor_columns(self):
+        """Returns columns of sensors of data file (like 'ADC0' or 'sensor00_ADC0')"""
+        return [key for key in load_data(self.filename_data_in).columns if key not in COLUMNS_NOT_SENSORS]
+
     def _create_Image_and_ImageDraw(self):
         """Create a PIL.Image.Image and a PIL.ImageDraw.ImageDraw"""
-        image = Image.new("RGBA", (self.DATAFRAME_WIDTH, self.DATAFRAME_HEIGHT), self.BACKGROUND_COLOR)
+        image = Image.new("RGB", (self.DATAFRAME_WIDTH, self.DATAFRAME_HEIGHT), self.BACKGROUND_COLOR)
         image_draw = ImageDraw.Draw(image)
         return image, image_draw
     
-    def _draw(self, image_draw, record):
-        """Draw data (record) on a PIL.ImageDraw.ImageDraw
-        and return this ImageDraw
+    def _fields(self, record):
+        if self.fields is None:
+            return record._fields
+        else:
+            return self.fields
+
+    def _boxes(self, fields):
+        """Returns layout as a list of (key, label, x, y, width, height)
         
         This method might be overload to customize drawing
         """
-        logger.debug("draw %r on %r" % (record, image_draw))
-
         width, height = 330, 25
         x0, y0 = 10, 590
-        
-        x, y = x0, y0
         delta_x, delta_y = 0, 30
-     
-        if self.fields is None:
-            fields = record._fields
-        else:
-            fields = self.fields
+        return [(key, self.data_formatter.label(key), x0, y0 + i * delta_y, width, height)
+            for i, key in enumerate(fields)]
 
-        for i, key in enumerate(fields):
-            value = record.__dict__[key]
-            text = self.data_formatter.text(key, value)
+    def _value_text(self, key, record):
+        return record.text(key)
+
+    def _draw(self, image_draw, record):
+        """Draw data (record) on a PIL.ImageDraw.ImageDraw
+        and return this ImageDraw
+        """
+        logger.debug("draw %r on %r" % (record, image_draw))
+        for key, label, x, y, width, height in self._boxes(self._fields(record)):
+            text = label + self._value_text(key, record)
             draw_boxed_text(image_draw, x, y, width, height, text, self.font, self.TEXT_COLOR, self.BOX_COLOR)
-            y += delta_y
- 
-        return image_draw
-        
         return image_draw
+
+    def _init_renderer(self, fields):
+        """Pre-render static layer (background, boxes and labels)
+        and compute region and position of each value"""
+        image, image_draw = self._create_Image_and_ImageDraw()
+        self._layout = []  # (key, region, (x, y) of value)
+        y_offset = 2
+        for key, label, x, y, width, height in self._boxes(fields):
+            image_draw.rectangle((x, y + y_offset, x + width, y + y_offset + height), outline=self.BOX_COLOR, fill=self.BOX_COLOR)
+            text_width, text_height = text_size(image_draw, label + "0", self.font)
+            y_text = y + ((height - text_height) / 2)
+            if label:
+                image_draw.text((x + 5, y_text), label, font=self.font, fill=self.TEXT_COLOR)
+                label_width = text_size(image_draw, label, self.font)[0]
+            else:
+                label_width = 0
+            # region redrawn when value changes: box and text (which might overflow box)
+            region = (x, int(min(y + y_offset, y_text)),
+                self.DATAFRAME_WIDTH, int(max(y + y_offset + height + 1, y_text + text_height + 1)))
+            self._layout.append((key, region, (x + 5 + label_width, y_text)))
+        regions = sorted(region for key, region, xy in self._layout)
+        self._dirty_regions = all(r1[3] <= r2[1] for r1, r2 in zip(regions[:-1], regions[1:]))
+        self._static = image
+        self._canvas = image.copy()
+        self._canvas_draw = ImageDraw.Draw(self._canvas)
+        self._texts_prev = None
+        # settings which change images (a frame is identified by settings and texts)
+        self._settings = repr((self.FONT_PATH, self.FONT_SIZE, self.TEXT_COLOR, self.BACKGROUND_COLOR,
+            self.BOX_COLOR, self.DATAFRAME_WIDTH, self.DATAFRAME_HEIGHT, self._boxes(fields)))
+        if GlyphAtlas.is_monospace(self.font):
+            self._atlas = GlyphAtlas(self.font, self.TEXT_COLOR)
+        else:
+            self._atlas = None
+
+    def _draw_value(self, xy, text):
+        if self._atlas is not None:
+            # pre-rendered glyphs (monospace font)
+            self._atlas.text(self._canvas, xy, text)
+        else:
+            self._canvas_draw.text(xy, text, font=self.font, fill=self.TEXT_COLOR)
+
+    def _texts(self, record):
+        """Returns value texts of record (in layout order)"""
+        if self._static is None:
+            self._init_renderer(self._fields(record))
+        return [self._value_text(key, record) for key, region, xy in self._layout]
+
+    def _frame_key(self, texts):
+        """Returns a hash of settings and texts of a frame"""
+        h = hashlib.sha1(self._settings.encode('utf-8'))
+        for text in texts:
+            h.update(b'\0' + text.encode('utf-8'))
+        return h.hexdigest()
+
+    def _render(self, record, texts=None):
+        """Render record on canvas - only values which changed are redrawn"""
+        if texts is None:
+            texts = self._texts(record)
+        if texts == self._texts_prev:
+            return self._canvas
+        if not self._dirty_regions:
+            # regions overlap: redraw every values
+            self._canvas.paste(self._static)
+            self._texts_prev = None
+        for i, (key, region, xy) in enumerate(self._layout):
+            if self._texts_prev is None or texts[i] != self._texts_prev[i]:
+                if self._dirty_regions:
+                    self._canvas.paste(self._static.crop(region), region)
+                self._draw_value(xy, texts[i])
+        self._texts_prev = texts
+        return self._canvas
     
     def _stop_frames_default(self, framenumber, framenumber_max):
         return framenumber >= framenumber_max - 1
@@ -145,123 +619,219 @@ class VideoOverlay(object):
     def _stop_frames(self, framenumber, framenumber_max):
         return self._stop_frames_default(framenumber, framenumber_max)
         
-    def _create_missing_frames(self, framenumber, framenumber_prev, framenumber_max):
+    def _create_missing_frames(self, sink, framenumber, framenumber_prev, framenumber_max, framenumber_source=None):
         """
-        Create symbolic links between last frame and this frame
+        Repeat last frame (or its source image) for missing frames
         (to avoid missing images because some frames are missing in data file)
         """
+        if framenumber_source is None:
+            framenumber_source = framenumber_prev
         for framenumber_missing in range(framenumber_prev + 1, framenumber):
-            file1 = os.path.join(self.directory_images, self.images_fmt % framenumber_prev)
-            file2 = os.path.join(self.directory_images, self.images_fmt % framenumber_missing)
-            logging.debug("Create symlink between %s and %s" % (file1, file2))
-            os.symlink(file1, file2)
-            if self._stop_frames(framenumber_missing, framenumber_max):
+            if self._stop_frames(framenumber_missing - 1, framenumber_max):
                 break
+            sink.repeat(framenumber_missing, framenumber_source)
         
         
-    def create_images(self, framenumber_max=None):
-        """
-        Create images with data and store them to 'images' directory
-        """
-
+    def _set_stop_frames(self, framenumber_max):
         if framenumber_max is None:
             self._stop_frames = self._stop_frames_never
         else:
             self._stop_frames = self._stop_frames_default
 
-        framenumber_prev = -1
-        self._init_pil()
-            
-        for record in self.records:
-            framenumber = record.frame
+    def create_images(self, framenumber_max=None, processes=1, resume=False, fps=25):
+        """
+        Create images with data and store them to 'images' directory
+        
+        Only distinct images are stored: frame_map.json gives image of
+        every frame and frames.ffconcat can be encoded with
+        ffmpeg -f concat -i frames.ffconcat -vsync cfr -r fps ...
+        
+        With processes > 1, frames are rendered by worker processes
+        (each worker renders contiguous frame ranges)
+        
+        With resume=True, images of a previous (maybe interrupted) run
+        are kept when their texts and drawing settings didn't change
+        (see manifest.json)
+        """
+        if resume:
+            if not os.path.exists(self.directory_images):
+                os.makedirs(self.directory_images)
+            manifest = self._load_manifest()
+        else:
+            self._clear_images()
+            manifest = {}
+        for filename in [self.filename_frame_map, self.filename_ffconcat]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        completed = False
+        frames = {}
+        frame_map = FrameMap()
+        try:
+            if processes > 1:
+                self._create_images_parallel(framenumber_max, processes, manifest if resume else None, frames, frame_map)
+            else:
+                self._set_stop_frames(framenumber_max)
+                self._init_pil()
+                sink = ImageFilesSink(self.directory_images, self.images_fmt, manifest if resume else None)
+                try:
+                    self._create_images_range(sink, None, None, -1, framenumber_max)
+                finally:
+                    frames.update(sink.frames)
+                    frame_map.update(sink.frame_map)
+            completed = True
+        finally:
+            if completed:
+                # a range rendered by a worker starts from last frame of previous
+                # range which might be a repeated frame (without image)
+                frame_map.resolve(frames)
+                self._remove_stale_images(frames)
+                self._save_frame_map(frame_map, fps)
+                manifest = {}
+            # (partial run: images not reached yet are kept)
+            manifest.update(frames)
+            self._save_manifest(manifest)
+
+    def _create_images_range(self, sink, start, stop, framenumber_prev, framenumber_max):
+        """Render frames of records start:stop to sink
+        framenumber_prev is the last frame rendered before start
+        """
+        framenumber_source = framenumber_prev  # frame of last image really encoded
+        texts_source = None
+        for record in self._records(start, stop, framenumber_prev):
+            framenumber = int(record.frame)
             if framenumber > framenumber_prev:
-                self._create_missing_frames(framenumber, framenumber_prev, framenumber_max)
+                self._create_missing_frames(sink, framenumber, framenumber_prev, framenumber_max, framenumber_source)
                 if self._stop_frames(framenumber, framenumber_max):
                     break
-                filename_image = os.path.join(self.directory_images, self.images_fmt % framenumber)
-                logger.debug("Create %r" % filename_image)
-                image, image_draw = self._create_Image_and_ImageDraw()
-                image_draw = self._draw(image_draw, record)
-                image.save(filename_image, "JPEG", quality=100)
+                texts = self._texts(record)
+                if texts == texts_source:
+                    # same texts as previous frame: no need to encode image again
+                    sink.repeat(framenumber, framenumber_source)
+                else:
+                    key = self._frame_key(texts)
+                    if not sink.is_up_to_date(framenumber, key):
+                        sink.write(framenumber, self._render(record, texts), key)
+                    framenumber_source = framenumber
+                    texts_source = texts
                 framenumber_prev = framenumber
-    
-    def create_overlay_video(self):
-        raise NotImplementedError("ToDo")
-
 
-class DataFormatter(object):
-    def __init__(self, key_default='%s', value_default='%s', key=None, value=None):
-        self.key_format_default = key_default
-        self.value_format_default = value_default
+    def _partition(self, processes, chunks_per_process=4, framenumber_max=None):
+        """Returns a list of (start, stop, framenumber_prev) - rows
+        of a same frame are never split between 2 ranges (ranges after
+        framenumber_max are skipped)"""
+        frames = np.asarray(load_data(self.filename_data_in).column('frame'))
+        n = len(frames)
+        # running max: last frame rendered before each row
+        frames_max = np.maximum.accumulate(frames) if n > 0 else frames
+        chunks = max(1, min(n, processes * chunks_per_process))
+        bounds = [0]
+        for i in range(1, chunks):
+            j = int(n * i / chunks)
+            # don't split rows of a frame
+            while 0 < j < n and frames[j] <= frames_max[j - 1]:
+                j += 1
+            if j > bounds[-1] and j < n:
+                bounds.append(j)
+        bounds.append(n)
+        ranges = [(start, stop, int(frames_max[start - 1]) if start > 0 else -1)
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+        if framenumber_max is not None:
+            ranges = [(start, stop, framenumber_prev) for start, stop, framenumber_prev in ranges
+                if framenumber_prev < framenumber_max - 1]
+        return ranges
+
+    def _create_images_parallel(self, framenumber_max, processes, manifest=None, frames=None, frame_map=None):
+        """Render frame ranges with a pool of processes - frames
+        (frame -> key) and frame_map are updated as ranges are completed
         
-        if key is None:
-            self.d_key_format = {}
-        else:
-            self.d_key_format = key
+        Workers update their own copy of manifest: frames they invalidated
+        are removed from manifest when their range is completed and every
+        frame of a range which was not completed is removed (its images
+        might have been replaced) when rendering is interrupted"""
+        ranges = self._partition(processes, framenumber_max=framenumber_max)
+        tasks = [(self, start, stop, framenumber_prev, framenumber_max, manifest)
+            for start, stop, framenumber_prev in ranges]
+        # frames of each range: framenumber_prev < frame <= framenumber_prev of next range
+        pending = dict((start, (framenumber_prev, framenumber_prev_next))
+            for (start, stop, framenumber_prev), framenumber_prev_next
+            in zip(ranges, [r[2] for r in ranges[1:]] + [None]))
+        logger.info("Rendering %d frame ranges with %d processes" % (len(tasks), processes))
+        pool = multiprocessing.Pool(processes)
+        try:
+            for start, frames_range, frame_map_range, invalidated in pool.imap_unordered(_create_images_worker, tasks):
+                del pending[start]
+                if manifest is not None:
+                    for framenumber in invalidated:
+                        manifest.pop(framenumber, None)
+                if frames is not None:
+                    frames.update(frames_range)
+                if frame_map is not None:
+                    frame_map.update(frame_map_range)
+        finally:
+            if pending:
+                # interrupted: workers must not replace images anymore
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+            if manifest is not None:
+                for framenumber_prev, framenumber_last in pending.values():
+                    for framenumber in list(manifest):
+                        if framenumber > framenumber_prev and (framenumber_last is None or framenumber <= framenumber_last):
+                            del manifest[framenumber]
+
+    def create_overlay_video(self, filename_out=None, fps=25, framenumber_max=None, encoder=None, encoder_options=None):
+        """
+        Create overlay video by streaming raw RGB frames to an encoder
+        (ffmpeg or avconv) - no image file is written
         
-        if value is None:
-            self.d_value_format = {}
-        else:
-            self.d_value_format = value
-     
-    def _get_format(self, key, d_fmt, fmt_default):
+        Fall back to images files (create_images) when no encoder is found
+        """
+        if filename_out is None:
+            filename_out = self.filename_video_out
+        if encoder is None:
+            encoder = find_encoder()
+        if encoder is None:
+            logger.warning("No video encoder found (%s) - creating images into %r" % ('/'.join(ENCODERS), self.directory_images))
+            return self.create_images(framenumber_max, fps=fps)
+
+        self._set_stop_frames(framenumber_max)
+        self._init_pil()
+        background = self._create_Image_and_ImageDraw()[0]
+        sink = EncoderPipeSink(filename_out, background.size, fps, encoder, encoder_options, background)
         try:
-            return d_fmt[key]
-        except KeyError:
-            return fmt_default
-    
-    def _get_value_format(self, key):
-        return self._get_format(key, self.d_value_format, self.value_format_default)
-    
-    def _get_key_format(self, key):
-        return self._get_format(key, self.d_key_format, self.key_format_default)
-    
-    def get_formats(self, key):
-        return self._get_key_format(key), self._get_value_format(key)
-     
-    def _key_value_format(self, key):
-        s_fmt = "%s: %s"
-        return s_fmt        
-
-    def text(self, key, value):
-        s_fmt = self._key_value_format(key)
-        s_key = self._get_key_format(key) % key
-        s_value = self._get_value_format(key) % value
-        text = s_fmt % (s_key, s_value)
-        return text
+            self._create_images_range(sink, None, None, -1, framenumber_max)
+        finally:
+            sink.close()
+        logger.info("%d frames written to %r" % (sink.frames_count, filename_out))
+
+
+def _create_images_worker(args):
+    """Render a range of frames in a worker process (with its own PIL font)
+    and returns start, frame -> key of images, frame map of this range
+    and frames invalidated in manifest"""
+    overlay, start, stop, framenumber_prev, framenumber_max, manifest = args
+    overlay._set_stop_frames(framenumber_max)
+    overlay._init_pil()
+    sink = ImageFilesSink(overlay.directory_images, overlay.images_fmt, manifest)
+    overlay._create_images_range(sink, start, stop, framenumber_prev, framenumber_max)
+    return start, sink.frames, sink.frame_map, sink.invalidated
+
 
 class MyVideoOverlay(VideoOverlay):
     def __init__(self, *args, **kwargs):
         super(MyVideoOverlay, self).__init__(*args, **kwargs)
     
-    def _draw(self, image_draw, record):
-        """Draw data (record) on a PIL.ImageDraw.ImageDraw
-        and return this ImageDraw
-        """
-        logger.debug("draw %r on %r" % (record, image_draw))
-
-        #draw data
+    def _boxes(self, fields):
+        """Returns layout: a box with time (without label) and a box
+        for each field"""
         x0, y0 = 10, 590
         width, height = self.DATAFRAME_WIDTH - x0, 25
-        
-        x, y = x0, y0
         delta_x, delta_y = 0, 30
-    
-        if self.fields is None:
-            fields = record._fields
-        else:
-            fields = self.fields
-
-        text = str(record.t)
-        draw_boxed_text(image_draw, x, y, width, height, text, self.font, self.TEXT_COLOR, self.BOX_COLOR)
-        y += delta_y
+        boxes = [(COL_T, '', x0, y0, width, height)]
         for i, key in enumerate(fields):
-            value = record.__dict__[key]
-            text = self.data_formatter.text(key, value)
-            draw_boxed_text(image_draw, x, y, width, height, text, self.font, self.TEXT_COLOR, self.BOX_COLOR)
-            y += delta_y
- 
-        return image_draw
+            boxes.append((key, self.data_formatter.label(key), x0, y0 + (i + 1) * delta_y, width, height))
+        return boxes
 
 
 @click.command()
@@ -270,7 +840,13 @@ class MyVideoOverlay(VideoOverlay):
 @click.option('--max-rows', default=20, help='Pandas display.max_rows')
 @click.option('--max-frames', default=-1, help='Maximum number of frame')
 @click.option('--font', default='', help='Font path')
-def main(directory, filename_data_in, max_rows, max_frames, font):
+@click.option('--processes', default=1, help='Number of rendering processes (0: number of CPU)')
+@click.option('--video/--images', default=False, help='Stream frames to a video encoder (ffmpeg/avconv) or create images files')
+@click.option('--filename-video-out', default='', help='Filename video output (default: video_overlay.h264)')
+@click.option('--fps', default=25, help='Frame rate of overlay video')
+@click.option('--resume/--no-resume', default=False, help='Keep images previously created when they are unchanged')
+@click.option('--fields', default='', help="Fields to display (comma separated) like 'frame,ADC0' - default: frame and every sensors")
+def main(directory, filename_data_in, max_rows, max_frames, font, processes, video, filename_video_out, fps, resume, fields):
     logging.basicConfig(level=logging.INFO)
     pd.set_option('display.max_rows', max_rows)
     
@@ -281,7 +857,11 @@ def main(directory, filename_data_in, max_rows, max_frames, font):
 
     overlay = MyVideoOverlay(directory, filename_data_in, font)
     
-    overlay.fields = ['frame', 'pos']
+    sensors = overlay.sensor_columns()
+    if fields:
+        overlay.fields = fields.split(',')
+    else:
+        overlay.fields = [COL_FRAME] + sensors
     #overlay.fields = ['t0', 'pos']
     
     #overlay.data_formatter = DataFormatter()
@@ -294,12 +874,21 @@ def main(directory, filename_data_in, max_rows, max_frames, font):
     #overlay.data_formatter.value_format_default = '%s'
     overlay.data_formatter.d_value_format = {
         'frame': '%06d',
-        'pos': '%05.1f',
     #    't0': '%07.3f'
     }
+    for key in sensors:
+        overlay.data_formatter.d_value_format[key] = '%05.1f'
+
 
+    if processes <= 0:
+        processes = multiprocessing.cpu_count()
 
-    overlay.create_images(framenumber_max=max_frames)
+    if video:
+        if filename_video_out == '':
+            filename_video_out = None
+        overlay.create_overlay_video(filename_video_out, fps=fps, framenumber_max=max_frames)
+    else:
+        overlay.create_images(framenumber_max=max_frames, processes=processes, resume=resume, fps=fps)
     
 if __name__ == '__main__':
     main()